@@ -0,0 +1,75 @@
+import argparse
+import logging
+import os
+import threading
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+_client = None
+_db = None
+_lock = threading.Lock()
+
+# Conexión segura a MongoDB Atlas, compartida por la app de escritorio y el bot.
+# El cliente se crea la primera vez que se usa, no al importar el módulo.
+def obtener_db():
+    global _client, _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                from pymongo import MongoClient
+                _client = MongoClient(os.getenv("MONGO_URI"))
+                _db = _client["guia_app"]
+    return _db
+
+# Referencia diferida a la base de datos: "db.usuarios" abre la conexión solo al usarse
+class _BaseDiferida:
+    def __getattr__(self, nombre):
+        return getattr(obtener_db(), nombre)
+
+    def __getitem__(self, nombre):
+        return obtener_db()[nombre]
+
+db = _BaseDiferida()
+
+# Crea los índices de las consultas de la app y del bot. Es idempotente: create_index no hace nada
+# si el índice ya existe. Un fallo (por ejemplo, correos duplicados que impiden el índice único)
+# se informa y no detiene a los demás.
+def asegurar_indices(base=None):
+    from pymongo import ASCENDING
+    from pymongo.errors import PyMongoError
+    from cola import INACTIVIDAD, VIGENCIA_TRABAJOS
+    from enlaces import VIGENCIA
+    base = db if base is None else base
+    indices = [
+        (base.usuarios, [("correo", ASCENDING)], {"unique": True, "name": "correo_unico"}),
+        (base.materias, [("nombre", ASCENDING)], {"name": "nombre"}),
+        (base.materias, [("semestre", ASCENDING), ("nombre", ASCENDING)], {"name": "semestre_nombre"}),
+        (base.fragmentos, [("tipo", ASCENDING), ("materia", ASCENDING), ("titulo_normalizado", ASCENDING)], {"name": "tipo_materia_titulo"}),
+        (base.trabajos, [("estado", ASCENDING), ("prioridad", ASCENDING), ("creado", ASCENDING)], {"name": "estado_prioridad"}),
+        (base.trabajos, [("destino.canal", ASCENDING), ("entregado", ASCENDING), ("estado", ASCENDING)], {"name": "entregas"}),
+        (base.trabajos, [("terminado", ASCENDING)], {"expireAfterSeconds": VIGENCIA_TRABAJOS, "name": "trabajos_vigencia"}),
+        (base.trabajadores, [("visto", ASCENDING)], {"expireAfterSeconds": INACTIVIDAD, "name": "trabajadores_vigencia"}),
+        (base.enlaces, [("creado", ASCENDING)], {"expireAfterSeconds": VIGENCIA, "name": "enlaces_vigencia"}),
+        (base.sesiones, [("expira", ASCENDING)], {"expireAfterSeconds": 0, "name": "sesiones_vigencia"}),
+        (base.limites, [("expira", ASCENDING)], {"expireAfterSeconds": 0, "name": "limites_vigencia"}),
+        (base.uso_diario, [("expira", ASCENDING)], {"expireAfterSeconds": 0, "name": "uso_diario_vigencia"}),
+    ]
+    creados = 0
+    for coleccion, claves, opciones in indices:
+        try:
+            coleccion.create_index(claves, **opciones)
+            creados += 1
+        except PyMongoError as e:
+            logging.error(f"No se pudo crear el índice {opciones['name']} en {coleccion.name}: {e}")
+    return creados == len(indices)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Utilidades de la base de datos de la app.")
+    parser.add_argument("--indices", action="store_true", help="crea los índices necesarios (idempotente)")
+    args = parser.parse_args()
+
+    if args.indices:
+        exit(0 if asegurar_indices() else 1)
+    parser.print_help()
@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Banco de pruebas de rendimiento sin servicios externos: OpenAI, MongoDB y Telegram se sustituyen
+# por dobles locales (OpenAIFalso, mongomock y actualizaciones sintéticas) y se miden los mismos
+# caminos de código que en producción.
+#
+#   python benchmark.py --chats 50 --mensajes 4 --latencia 0.5 --prob-429 0.05
+#   python benchmark.py --escenario app --usuarios 10
+#
+# Requiere mongomock (pip install mongomock).
+
+PALABRAS = (
+    "energia fuerza masa celula atomo molecula reaccion ecuacion derivada integral matriz vector "
+    "algoritmo memoria proceso sistema red protocolo circuito voltaje corriente onda"
+).split()
+
+# Doble de openai.ChatCompletion: latencia hasta el primer token, velocidad de generación en
+# tokens por segundo, flujo de fragmentos y errores 429 con la probabilidad indicada
+class _ChatCompletionFalso:
+    def __init__(self, latencia, tokens_por_segundo, tokens_respuesta, prob_429):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens_respuesta = tokens_respuesta
+        self.prob_429 = prob_429
+        self.llamadas = 0
+        self.limitadas = 0
+        self._lock = threading.Lock()
+
+    def _preparar(self, max_tokens):
+        import openai
+        with self._lock:
+            self.llamadas += 1
+            limitar = random.random() < self.prob_429
+            if limitar:
+                self.limitadas += 1
+        if limitar:
+            raise openai.error.RateLimitError("Rate limit reached (simulado)", headers={"retry-after": "1"})
+        tokens = min(max_tokens, self.tokens_respuesta)
+        return tokens, " ".join(random.choice(PALABRAS) for _ in range(tokens)) + "."
+
+    def _respuesta(self, texto, tokens):
+        return {
+            "choices": [{"message": {"content": texto}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 50, "completion_tokens": tokens}
+        }
+
+    async def _flujo(self, texto):
+        palabras = texto.split(" ")
+        await asyncio.sleep(self.latencia)
+        # Los tokens se entregan en grupos de 5 para no saturar el bucle con esperas diminutas
+        for inicio in range(0, len(palabras), 5):
+            await asyncio.sleep(5 / self.tokens_por_segundo)
+            yield {"choices": [{"delta": {"content": " ".join(palabras[inicio:inicio + 5]) + " "}}]}
+
+    async def acreate(self, model=None, messages=None, max_tokens=500, stream=False, **kwargs):
+        tokens, texto = self._preparar(max_tokens)
+        if stream:
+            return self._flujo(texto)
+        await asyncio.sleep(self.latencia + tokens / self.tokens_por_segundo)
+        return self._respuesta(texto, tokens)
+
+    def _flujo_sincrono(self, texto):
+        palabras = texto.split(" ")
+        time.sleep(self.latencia)
+        for inicio in range(0, len(palabras), 5):
+            time.sleep(5 / self.tokens_por_segundo)
+            yield {"choices": [{"delta": {"content": " ".join(palabras[inicio:inicio + 5]) + " "}}]}
+
+    def create(self, model=None, messages=None, max_tokens=500, stream=False, **kwargs):
+        tokens, texto = self._preparar(max_tokens)
+        if stream:
+            return self._flujo_sincrono(texto)
+        time.sleep(self.latencia + tokens / self.tokens_por_segundo)
+        return self._respuesta(texto, tokens)
+
+class OpenAIFalso:
+    def __init__(self, **configuracion):
+        self.ChatCompletion = _ChatCompletionFalso(**configuracion)
+
+# Mensajes, chats y actualizaciones sintéticas de Telegram con la latencia de envío indicada
+class _Envios:
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.enviados = 0
+
+    async def enviar(self):
+        await asyncio.sleep(self.latencia)
+        self.enviados += 1
+
+class MensajeFalso:
+    def __init__(self, texto, envios, al_responder=None):
+        self.text = texto
+        self._envios = envios
+        self._al_responder = al_responder
+
+    async def reply_text(self, texto, **kwargs):
+        await self._envios.enviar()
+        if self._al_responder:
+            self._al_responder(texto)
+        return MensajeFalso(texto, self._envios)
+
+    async def edit_text(self, texto, **kwargs):
+        await self._envios.enviar()
+        self.text = texto
+
+class BotFalso:
+    def __init__(self, envios):
+        self._envios = envios
+
+    async def send_message(self, chat_id, texto, **kwargs):
+        await self._envios.enviar()
+
+class _Identidad:
+    def __init__(self, identificador):
+        self.id = identificador
+        self.username = f"usuario{identificador}"
+
+class ActualizacionFalsa:
+    def __init__(self, chat_id, texto, envios, al_responder):
+        self.message = MensajeFalso(texto, envios, al_responder)
+        self.effective_chat = _Identidad(chat_id)
+        self.effective_user = _Identidad(chat_id)
+        self._bot = BotFalso(envios)
+
+    def get_bot(self):
+        return self._bot
+
+class ContextoFalso:
+    def __init__(self):
+        self.user_data = {}
+        self.args = []
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p * len(ordenados) + 0.5) - 1))]
+
+def reportar(nombre, latencias, duracion):
+    if not latencias:
+        print(f"{nombre}: sin datos")
+        return
+    print(
+        f"{nombre}: n={len(latencias)} p50={percentil(latencias, 0.5):.3f}s p95={percentil(latencias, 0.95):.3f}s "
+        f"p99={percentil(latencias, 0.99):.3f}s max={max(latencias):.3f}s media={statistics.mean(latencias):.3f}s "
+        f"rendimiento={len(latencias) / duracion:.1f}/s"
+    )
+
+# Base de datos local con un catálogo de materias y usuarios de prueba
+def preparar_base(materias, temas_por_materia, usuarios):
+    import mongomock
+    import base_datos
+    base_datos._db = mongomock.MongoClient()["guia_app"]
+    db = base_datos._db
+    base_datos.asegurar_indices(db)
+    db.materias.insert_many([
+        {
+            "nombre": f"Materia {m}",
+            "semestre": m % 9 + 1,
+            "temas": [{"numero": t + 1, "titulo": f"Tema {t + 1} de materia {m}"} for t in range(temas_por_materia)]
+        }
+        for m in range(materias)
+    ])
+    if usuarios:
+        from passlib.hash import pbkdf2_sha256
+        contraseña = pbkdf2_sha256.hash("secreta")
+        db.usuarios.insert_many([
+            {"correo": f"usuario{u}@ugto.mx", "nombre": f"usuario{u}", "contraseña": contraseña}
+            for u in range(usuarios)
+        ])
+    return db
+
+def peticion_sintetica(db, accion, repetidas):
+    if accion == "pregunta":
+        if random.random() < repetidas:
+            return "¿Qué es la energía cinética?"
+        return f"¿Qué relación hay entre {' y '.join(random.sample(PALABRAS, 3))}?"
+    materia = db.materias.find_one({}, {"temas.numero": 1, "temas.titulo": 1}, skip=random.randrange(db.materias.count_documents({})))
+    temas = random.sample(materia["temas"], min(3, len(materia["temas"])))
+    return ", ".join(f"{t['numero']}. {t['titulo']}" for t in temas)
+
+# N chats simultáneos que envían M mensajes cada uno a handle_text
+async def escenario_bot(args, db):
+    import bot
+    bot.RESPUESTA_EN_FLUJO = not args.sin_flujo
+    envios = _Envios(args.latencia_telegram)
+    acciones = ["pregunta", "resumen", "guia"] if args.accion == "mixta" else [args.accion]
+    latencias, primeras, en_cola = [], [], 0
+
+    async def chat(chat_id):
+        nonlocal en_cola
+        contexto = ContextoFalso()
+        for _ in range(args.mensajes):
+            accion = random.choice(acciones)
+            texto = peticion_sintetica(db, accion, args.repetidas)
+            inicio = time.perf_counter()
+            primera = []
+
+            def al_responder(respuesta):
+                nonlocal en_cola
+                if not primera:
+                    primera.append(time.perf_counter() - inicio)
+                if respuesta == bot.MENSAJE_EN_COLA or respuesta.endswith(bot.MENSAJE_EN_COLA):
+                    en_cola += 1
+
+            contexto.user_data["action"] = accion
+            await bot.handle_text(ActualizacionFalsa(chat_id, texto, envios, al_responder), contexto)
+            latencias.append(time.perf_counter() - inicio)
+            primeras.extend(primera)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[chat(1000 + i) for i in range(args.chats)])
+    duracion = time.perf_counter() - inicio
+    print(f"\n== Bot: {args.chats} chats x {args.mensajes} mensajes ({args.accion}, {'sin flujo' if args.sin_flujo else 'en flujo'}) en {duracion:.2f}s")
+    reportar("respuesta completa", latencias, duracion)
+    reportar("primer mensaje", primeras, duracion)
+    print(f"mensajes enviados/editados: {envios.enviados}, peticiones en cola por 429: {en_cola}")
+
+# Flujo de la app de escritorio sin ventana: inicio de sesión, catálogo, temas, resumen y PDF
+def escenario_app(args, db):
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+    # La sesión que guarda el inicio de sesión no debe pisar la del equipo
+    os.environ.setdefault("SESION_ARCHIVO", os.path.join(tempfile.mkdtemp(prefix="bee_sesion_"), "sesion.json"))
+    import main
+    from catalogo import CatalogoLocal
+    from credenciales import crear_sesion, validar_sesion
+    from cola import latir, procesar, tomar_trabajo
+
+    class PantallaSinVentana:
+        obtener_resumen_openai = main.TemarioScreen.obtener_resumen_openai
+        obtener_guia_openai = main.TemarioScreen.obtener_guia_openai
+        generar_texto = main.TemarioScreen.generar_texto
+        obtener_en_flujo = main.TemarioScreen.obtener_en_flujo
+        esperar_en_cola = main.TemarioScreen.esperar_en_cola
+
+        def __init__(self, materia):
+            self.materia = materia
+
+    # Un trabajador de la cola en un hilo, para las generaciones que caen en 429
+    detener = threading.Event()
+
+    def trabajador():
+        while not detener.is_set():
+            latir(db, "benchmark")
+            trabajo = tomar_trabajo(db, "benchmark")
+            if trabajo is None:
+                detener.wait(0.2)
+            else:
+                procesar(db, trabajo)
+
+    threading.Thread(target=trabajador, daemon=True).start()
+    etapas = {"inicio_sesion": [], "sesion_guardada": [], "catalogo": [], "temas": [], "resumen": [], "pdf": [], "total": []}
+    if args.app_en_flujo:
+        etapas["primer_fragmento"] = []
+    directorio = tempfile.mkdtemp(prefix="bee_benchmark_")
+
+    def usuario(numero):
+        tiempos = {}
+        inicio = marca = time.perf_counter()
+        assert main.login_user(f"usuario{numero}@ugto.mx", "secreta")
+        tiempos["inicio_sesion"] = time.perf_counter() - marca
+
+        # Una visita posterior entra con el token de sesión en lugar de la contraseña
+        token = crear_sesion(db, f"usuario{numero}@ugto.mx")
+        marca = time.perf_counter()
+        assert validar_sesion(db, token)
+        tiempos["sesion_guardada"] = time.perf_counter() - marca
+
+        marca = time.perf_counter()
+        catalogo = CatalogoLocal(os.path.join(directorio, f"catalogo_{numero}.json"))
+        catalogo.actualizar_si_cambio(db)
+        semestre, materias = random.choice(catalogo.semestres())
+        tiempos["catalogo"] = time.perf_counter() - marca
+
+        marca = time.perf_counter()
+        materia = random.choice(materias)
+        documento = db.materias.find_one({"nombre": materia}, {"_id": 0, "temas.numero": 1, "temas.titulo": 1})
+        temas = [main.titulo_tema(t) for t in random.sample(documento["temas"], min(args.temas_seleccionados, len(documento["temas"])))]
+        tiempos["temas"] = time.perf_counter() - marca
+
+        marca = time.perf_counter()
+        if args.app_en_flujo:
+            # Tiempo hasta que el visor tendría el primer texto que mostrar
+            def recibir(fragmento):
+                tiempos.setdefault("primer_fragmento", time.perf_counter() - marca)
+            resumen = PantallaSinVentana(materia).obtener_en_flujo("resumen", temas, recibir, threading.Event())
+        else:
+            resumen = PantallaSinVentana(materia).obtener_resumen_openai(temas)
+        tiempos["resumen"] = time.perf_counter() - marca
+
+        marca = time.perf_counter()
+        main.crear_pdf("Resumen", resumen)
+        tiempos["pdf"] = time.perf_counter() - marca
+        tiempos["total"] = time.perf_counter() - inicio
+        return tiempos
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.usuarios) as pool:
+        for tiempos in pool.map(usuario, range(args.usuarios)):
+            for etapa, segundos in tiempos.items():
+                etapas[etapa].append(segundos)
+    duracion = time.perf_counter() - inicio
+    detener.set()
+    print(f"\n== App: {args.usuarios} usuarios simultáneos, {args.temas_seleccionados} temas cada uno, en {duracion:.2f}s")
+    for etapa, latencias in etapas.items():
+        reportar(etapa, latencias, duracion)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento con OpenAI, MongoDB y Telegram simulados.")
+    parser.add_argument("--escenario", choices=["bot", "app", "todo"], default="bot")
+    parser.add_argument("--chats", type=int, default=20, help="chats simultáneos (escenario bot)")
+    parser.add_argument("--mensajes", type=int, default=3, help="mensajes por chat (escenario bot)")
+    parser.add_argument("--accion", choices=["pregunta", "resumen", "guia", "mixta"], default="mixta")
+    parser.add_argument("--sin-flujo", action="store_true", help="responder sin editar el mensaje en flujo")
+    parser.add_argument("--repetidas", type=float, default=0.3, help="fracción de preguntas repetidas")
+    parser.add_argument("--usuarios", type=int, default=5, help="usuarios simultáneos (escenario app)")
+    parser.add_argument("--app-en-flujo", action="store_true", help="generar el resumen en flujo, como la vista previa (escenario app)")
+    parser.add_argument("--temas-seleccionados", type=int, default=4, help="temas por resumen (escenario app)")
+    parser.add_argument("--latencia", type=float, default=0.3, help="segundos hasta el primer token de OpenAI")
+    parser.add_argument("--tokens-por-segundo", type=float, default=200)
+    parser.add_argument("--tokens-respuesta", type=int, default=150, help="tokens de cada respuesta simulada")
+    parser.add_argument("--prob-429", type=float, default=0.0, help="probabilidad de RateLimitError por llamada")
+    parser.add_argument("--latencia-telegram", type=float, default=0.02, help="segundos por mensaje enviado o editado")
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    random.seed(args.semilla)
+
+    db = preparar_base(materias=12, temas_por_materia=15, usuarios=args.usuarios if args.escenario != "bot" else 0)
+    import generacion
+    falso = OpenAIFalso(
+        latencia=args.latencia,
+        tokens_por_segundo=args.tokens_por_segundo,
+        tokens_respuesta=args.tokens_respuesta,
+        prob_429=args.prob_429
+    )
+    generacion._openai = falso
+
+    if args.escenario in ("bot", "todo"):
+        asyncio.run(escenario_bot(args, db))
+    if args.escenario in ("app", "todo"):
+        escenario_app(args, db)
+
+    from metricas import metricas
+    print(f"\n== Llamadas a OpenAI: {falso.ChatCompletion.llamadas}, con 429: {falso.ChatCompletion.limitadas}")
+    print(f"\n== Etapas\n{metricas.resumen()}")
@@ -1,9 +1,29 @@
+import time
+
+# Marca de inicio para medir el arranque del bot
+_INICIO = time.perf_counter()
+
+import argparse
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from dotenv import load_dotenv
 import os
-import openai
+import asyncio
+import math
+from pathlib import Path
+from base_datos import asegurar_indices, db
+from cola import encolar, es_reintentable, parte_trabajo, profundidad_cola, reclamar_entrega
+from enlaces import leer_enlace
+from cache_preguntas import obtener_cache_preguntas
+from generacion import (
+    completar_con_cache, completar_en_flujo_con_cache, completar_en_flujo_pregunta, completar_pregunta, turno_de_peticion
+)
+from limites import limitador
+from metricas import metricas
+from pdfs import renderizador
+from presupuesto import MAX_ENTRADA, contar_tokens, dividir_temas, max_tokens_para, recortar, separar_temas
 
 # Carga las variables de entorno
 load_dotenv()
@@ -18,69 +38,355 @@ logging.basicConfig(
 TOKEN_BOT = os.getenv('TOKEN_BOT')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Configura la clave de API de OpenAI
-openai.api_key = OPENAI_API_KEY
+# La clave de API de OpenAI se configura al hacer la primera llamada (ver generacion.obtener_openai)
+_FIN_IMPORTACION = time.perf_counter()
+
+# Modo en flujo: la respuesta se va mostrando editando el mensaje conforme llega del modelo
+RESPUESTA_EN_FLUJO = os.getenv('BOT_RESPUESTA_EN_FLUJO', '1') == '1'
+# Segundos mínimos entre ediciones de un mismo mensaje, para no rebasar los límites de Telegram
+INTERVALO_EDICION = float(os.getenv('BOT_INTERVALO_EDICION', '1.5'))
+# Actualizaciones que se procesan a la vez (polling y webhook)
+ACTUALIZACIONES_CONCURRENTES = int(os.getenv('BOT_ACTUALIZACIONES_CONCURRENTES', '64'))
+# Guardar el estado de las conversaciones en MongoDB (necesario para correr varias instancias)
+PERSISTENCIA = os.getenv('BOT_PERSISTENCIA', '1') == '1'
+# Mandar todas las peticiones a la cola de trabajos en lugar de generarlas en el momento
+USAR_COLA = os.getenv('BOT_USAR_COLA', '0') == '1'
+# Segundos entre revisiones de trabajos terminados por entregar
+INTERVALO_ENTREGAS = float(os.getenv('BOT_INTERVALO_ENTREGAS', '2'))
+# Segundos que /start <token> espera el resultado que genera la app antes de generarlo el bot
+ESPERA_ENLACE = float(os.getenv('BOT_ESPERA_ENLACE', '20'))
+# Usuarios de Telegram (ids separados por comas) que pueden usar /stats
+ADMINISTRADORES = {int(i) for i in os.getenv('BOT_ADMINISTRADORES', '').split(',') if i.strip()}
+# Puerto de un servidor propio de métricas (/metrics), útil en modo polling; vacío = sin servidor.
+# En modo webhook las métricas también se sirven en el puerto del webhook.
+PUERTO_METRICAS = os.getenv('BOT_METRICAS_PUERTO')
+# Enviar los resúmenes y guías que no caben en un mensaje como PDF en lugar de varios mensajes
+ENVIAR_PDF = os.getenv('BOT_ENVIAR_PDF', '1') == '1'
+# Texto que queda en el mensaje en flujo cuando el resultado no cabe y se enviará como PDF
+AVISO_PDF = "⏳ El texto no cabe en un mensaje; te lo envío en PDF en cuanto esté listo."
+# Longitud máxima de un mensaje de Telegram
+LIMITE_MENSAJE = 4096
+
+# Instrucciones de sistema de cada tipo de generación
+SISTEMA_RESUMEN = "Eres un asistente que genera resúmenes educativos."
+SISTEMA_GUIA = "Eres un asistente que genera guías de estudio educativas."
+SISTEMA_PREGUNTA = "Eres un asistente educativo capaz de responder preguntas y realizar tareas según lo solicitado."
+
+# Encabezado de la respuesta de cada acción
+ENCABEZADOS = {
+    'resumen': "✅ Resumen generado:",
+    'guia': "📘 Guía de estudio generada:",
+    'pregunta': "🤖 Respuesta:"
+}
+# Título del PDF de cada acción; es el mismo de la app, así que el mismo texto reutiliza el mismo PDF
+TITULOS_PDF = {
+    'resumen': "Resumen",
+    'guia': "Guía de Estudio"
+}
+# Respuesta cuando un chat rebasa su límite (ver limites.py)
+def mensaje_limite(motivo, segundos):
+    if motivo == "cuota":
+        horas, minutos = divmod(math.ceil(segundos / 60), 60)
+        return f"📊 Llegaste a tu límite de uso de hoy. Inténtalo de nuevo en {horas} h {minutos} min."
+    return f"⏳ Estás enviando mensajes muy rápido. Inténtalo de nuevo en {segundos} s."
+
+MENSAJE_EN_COLA = (
+    "⏳ Hay mucha demanda en este momento. Tu petición quedó en cola "
+    "y te enviaré la respuesta en cuanto esté lista."
+)
+
+# Tipo, instrucciones de sistema, prompt y tokens de respuesta de cada acción.
+# Para resumen y guía, "texto" son los temas (normalmente un grupo de presupuesto.dividir_temas);
+# los temas o la pregunta que pasan de MAX_ENTRADA tokens se recortan, y los tokens de respuesta
+# se calculan con los del prompt para no pasar del contexto del modelo.
+def preparar_peticion(user_action, texto):
+    if user_action in ('resumen', 'guia'):
+        temas = separar_temas(texto)
+        lista = recortar(', '.join(temas), MAX_ENTRADA)
+        if user_action == 'resumen':
+            sistema = SISTEMA_RESUMEN
+            prompt = f"Genera un resumen detallado para los siguientes temas, sin comentarios adicionales: {lista}"
+        else:
+            sistema = SISTEMA_GUIA
+            prompt = f"Genera una guía de estudio con preguntas clave para los siguientes temas, sin comentarios adicionales: {lista}"
+        tokens_prompt = contar_tokens(sistema) + contar_tokens(prompt)
+        return user_action, sistema, prompt, max_tokens_para(user_action, len(temas), tokens_prompt)
+    pregunta = recortar(texto, MAX_ENTRADA)
+    tokens_prompt = contar_tokens(SISTEMA_PREGUNTA) + contar_tokens(pregunta)
+    return "pregunta", SISTEMA_PREGUNTA, pregunta, max_tokens_para("pregunta", tokens_prompt=tokens_prompt)
+
+# Deja la petición en la cola de trabajos (ver cola.py); la respuesta llega con entregar_resultados.
+# Un resumen o guía lleva una parte por grupo de temas, con los mismos prompts y claves de caché
+# que generar_por_grupos.
+async def encolar_peticion(user_action, texto, chat_id):
+    if user_action in ('resumen', 'guia'):
+        partes = []
+        for grupo in dividir_temas(user_action, texto):
+            tipo, sistema, prompt, max_tokens = preparar_peticion(user_action, grupo)
+            partes.append(parte_trabajo(sistema, prompt, max_tokens, ", ".join(grupo)))
+    else:
+        tipo, sistema, prompt, max_tokens = preparar_peticion(user_action, texto)
+        partes = [parte_trabajo(sistema, prompt, max_tokens)]
+    await asyncio.to_thread(encolar, db, tipo, partes, {"canal": "telegram", "chat_id": chat_id})
+
+# Resumen o guía: los temas que no caben en una respuesta se reparten en grupos
+# (ver presupuesto.dividir_temas) que se generan por separado y se unen en orden.
+# Los grupos comparten un solo turno del chat, así se generan a la vez y no esperan unos a otros.
+async def generar_por_grupos(user_action, temas, chat_id=None):
+    grupos = dividir_temas(user_action, temas)
+    async with turno_de_peticion(chat_id):
+        solicitudes = []
+        for grupo in grupos:
+            tipo, sistema, prompt, max_tokens = preparar_peticion(user_action, grupo)
+            solicitudes.append(
+                completar_con_cache(tipo, ", ".join(grupo), sistema, prompt, max_tokens=max_tokens, chat_id=chat_id)
+            )
+        return "\n\n".join(await asyncio.gather(*solicitudes))
 
 # Función para generar resumen usando la API de OpenAI
-def generar_resumen(temas):
+async def generar_resumen(temas, chat_id=None):
     try:
-        if len(temas) > 2000:
-            return "El texto es demasiado largo. Por favor, intenta resumirlo."
-        prompt = f"Genera un resumen detallado para los siguientes temas, sin comentarios adicionales: {temas}"
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente que genera resúmenes educativos."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
-        )
-        return respuesta["choices"][0]["message"]["content"].strip()
+        return await generar_por_grupos('resumen', temas, chat_id)
+    except asyncio.TimeoutError:
+        return "La generación tardó demasiado. Inténtalo de nuevo en unos momentos."
     except Exception as e:
+        # Ante límites de uso o fallas pasajeras de OpenAI la petición se encola en lugar de fallar
+        if chat_id is not None and es_reintentable(e):
+            await encolar_peticion('resumen', temas, chat_id)
+            return None
         logging.error(f"Error al generar resumen: {e}")
         return "Error al generar el resumen. Inténtalo más tarde."
 
 # Función para generar guía de estudio usando la API de OpenAI
-def generar_guia(temas):
+async def generar_guia(temas, chat_id=None):
     try:
-        if len(temas) > 2000:
-            return "El texto es demasiado largo. Por favor, intenta resumirlo."
-        prompt = f"Genera una guía de estudio con preguntas clave para los siguientes temas, sin comentarios adicionales: {temas}"
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente que genera guías de estudio educativas."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
-        )
-        return respuesta["choices"][0]["message"]["content"].strip()
+        return await generar_por_grupos('guia', temas, chat_id)
+    except asyncio.TimeoutError:
+        return "La generación tardó demasiado. Inténtalo de nuevo en unos momentos."
     except Exception as e:
+        # Ante límites de uso o fallas pasajeras de OpenAI la petición se encola en lugar de fallar
+        if chat_id is not None and es_reintentable(e):
+            await encolar_peticion('guia', temas, chat_id)
+            return None
         logging.error(f"Error al generar guía: {e}")
         return "Error al generar la guía de estudio. Inténtalo más tarde."
 
 # Función para manejar preguntas o peticiones adicionales usando la API de OpenAI
-def responder_pregunta(peticion):
+async def responder_pregunta(peticion, chat_id=None):
     try:
-        if len(peticion) > 2000:
-            return "El texto es demasiado largo. Por favor, intenta resumirlo."
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente educativo capaz de responder preguntas y realizar tareas según lo solicitado."},
-                {"role": "user", "content": peticion}
-            ],
-            max_tokens=500
+        _, sistema, prompt, max_tokens = preparar_peticion('pregunta', peticion)
+        return await completar_pregunta(
+            sistema,
+            prompt,
+            max_tokens=max_tokens,
+            chat_id=chat_id
         )
-        return respuesta["choices"][0]["message"]["content"].strip()
+    except asyncio.TimeoutError:
+        return "La generación tardó demasiado. Inténtalo de nuevo en unos momentos."
     except Exception as e:
+        # Ante límites de uso o fallas pasajeras de OpenAI la petición se encola en lugar de fallar
+        if chat_id is not None and es_reintentable(e):
+            await encolar_peticion('pregunta', peticion, chat_id)
+            return None
         logging.error(f"Error al responder la pregunta: {e}")
         return "Error al procesar tu petición. Inténtalo más tarde."
 
+# Versión en flujo de generar_por_grupos: los grupos se transmiten uno tras otro
+async def flujo_por_grupos(user_action, temas, chat_id=None):
+    for numero, grupo in enumerate(dividir_temas(user_action, temas)):
+        tipo, sistema, prompt, max_tokens = preparar_peticion(user_action, grupo)
+        if numero:
+            yield "\n\n"
+        async for fragmento in completar_en_flujo_con_cache(
+            tipo, ", ".join(grupo), sistema, prompt, max_tokens=max_tokens, chat_id=chat_id
+        ):
+            yield fragmento
+
+# Genera la respuesta de una acción en flujo; los errores se entregan como un último fragmento
+async def generar_en_flujo(user_action, texto, chat_id=None):
+    try:
+        if user_action == 'pregunta':
+            _, sistema, prompt, max_tokens = preparar_peticion(user_action, texto)
+            fragmentos = completar_en_flujo_pregunta(sistema, prompt, max_tokens=max_tokens, chat_id=chat_id)
+        else:
+            fragmentos = flujo_por_grupos(user_action, texto, chat_id)
+        async for fragmento in fragmentos:
+            yield fragmento
+    except asyncio.TimeoutError:
+        yield "\n\nLa generación tardó demasiado. Inténtalo de nuevo en unos momentos."
+    except Exception as e:
+        if chat_id is not None and es_reintentable(e):
+            await encolar_peticion(user_action, texto, chat_id)
+            yield f"\n\n{MENSAJE_EN_COLA}"
+            return
+        logging.error(f"Error al generar en flujo ({user_action}): {e}")
+        yield "\n\nError al procesar tu petición. Inténtalo más tarde."
+
+# Posición donde partir un texto largo: el último salto de línea o espacio antes del límite,
+# para no cortar palabras
+def punto_de_corte(texto):
+    for separador in ("\n", " "):
+        corte = texto.rfind(separador, 0, LIMITE_MENSAJE)
+        if corte > LIMITE_MENSAJE // 2:
+            return corte
+    return LIMITE_MENSAJE
+
+# Envía un texto a un chat en uno o varios mensajes según el límite de Telegram
+async def enviar_texto_largo(bot, chat_id, texto):
+    with metricas.medir("telegram_envio"):
+        while len(texto) > LIMITE_MENSAJE:
+            corte = punto_de_corte(texto)
+            await bot.send_message(chat_id, texto[:corte])
+            texto = texto[corte:].lstrip()
+        if texto:
+            await bot.send_message(chat_id, texto)
+
+# Envía un resumen o guía como documento PDF (ver pdfs.py); devuelve False si no se pudo
+async def enviar_pdf(bot, chat_id, user_action, texto, leyenda):
+    try:
+        ruta = await renderizador.renderizar_async(TITULOS_PDF[user_action], texto)
+        with metricas.medir("telegram_envio"):
+            await bot.send_document(chat_id, document=Path(ruta), filename=f"{user_action}.pdf", caption=leyenda)
+        return True
+    except Exception as e:
+        logging.error(f"Error al enviar el PDF ({user_action}): {e}")
+        return False
+
+# Envía el resultado de una acción. Un resumen o guía que no cabe en un mensaje se manda como PDF
+# en lugar de partirlo en varios mensajes de texto.
+async def enviar_resultado(bot, chat_id, user_action, texto):
+    encabezado = ENCABEZADOS.get(user_action, ENCABEZADOS['pregunta'])
+    if ENVIAR_PDF and user_action in TITULOS_PDF and len(texto) > LIMITE_MENSAJE:
+        if await enviar_pdf(bot, chat_id, user_action, texto, encabezado):
+            return
+    await enviar_texto_largo(bot, chat_id, f"{encabezado}\n\n{texto}")
+
+# Entrega en su chat los trabajos de la cola ya terminados. Cada trabajo se reclama de forma
+# atómica, así que con varias instancias del bot cada respuesta se envía una sola vez.
+async def entregar_resultados(application):
+    while True:
+        try:
+            trabajo = await asyncio.to_thread(reclamar_entrega, db, "telegram")
+        except Exception as e:
+            logging.error(f"Error al consultar entregas pendientes: {e}")
+            trabajo = None
+        if trabajo is None:
+            await asyncio.sleep(INTERVALO_ENTREGAS)
+            continue
+        chat_id = trabajo["destino"]["chat_id"]
+        try:
+            if trabajo["estado"] == "terminado":
+                await enviar_resultado(application.bot, chat_id, trabajo["tipo"], trabajo["resultado"])
+            else:
+                await enviar_texto_largo(application.bot, chat_id, "Error al procesar tu petición. Inténtalo más tarde.")
+        except Exception as e:
+            logging.error(f"Error al entregar el trabajo {trabajo['_id']}: {e}")
+
+# Mensaje de Telegram que se actualiza conforme llega el texto.
+# El primer fragmento se envía de inmediato; después se edita como mucho cada INTERVALO_EDICION
+# segundos y, al rebasar LIMITE_MENSAJE, el texto sigue en un mensaje nuevo. Con aviso_al_llenar,
+# al rebasar LIMITE_MENSAJE el mensaje se reemplaza por ese aviso y deja de actualizarse ("lleno"),
+# para que quien lo usa envíe el texto completo de otra forma.
+class MensajeEnFlujo:
+    def __init__(self, origen, encabezado, aviso_al_llenar=None):
+        self.origen = origen
+        self.mensaje = None
+        self.encabezado = encabezado
+        self.texto = f"{encabezado}\n\n"
+        self.enviado = ""
+        self.ultima_edicion = 0.0
+        self.aviso_al_llenar = aviso_al_llenar
+        self.lleno = False
+
+    async def agregar(self, fragmento):
+        if self.lleno:
+            return
+        self.texto += fragmento
+        if self.aviso_al_llenar is not None and len(self.texto) > LIMITE_MENSAJE:
+            self.lleno = True
+            await self._publicar(f"{self.encabezado}\n\n{self.aviso_al_llenar}", forzar=True)
+            return
+        while len(self.texto) > LIMITE_MENSAJE:
+            corte = punto_de_corte(self.texto)
+            parte, self.texto = self.texto[:corte], self.texto[corte:].lstrip()
+            await self._publicar(parte, forzar=True)
+            self.mensaje = None
+        await self._publicar(self.texto)
+
+    async def terminar(self):
+        if not self.lleno:
+            await self._publicar(self.texto, forzar=True)
+
+    async def _publicar(self, texto, forzar=False):
+        texto = texto.strip()
+        if not texto or texto == self.enviado:
+            return
+        if self.mensaje is not None and not forzar and time.monotonic() - self.ultima_edicion < INTERVALO_EDICION:
+            return
+        with metricas.medir("telegram_envio"):
+            if self.mensaje is None:
+                self.mensaje = await self.origen.reply_text(texto)
+            else:
+                try:
+                    await self.mensaje.edit_text(texto)
+                except RetryAfter as e:
+                    if not forzar:
+                        return
+                    await asyncio.sleep(e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds())
+                    await self.mensaje.edit_text(texto)
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+        self.enviado = texto
+        self.ultima_edicion = time.monotonic()
+
+# Envía la respuesta de una acción editando el mensaje en flujo. Un resumen o guía que no cabe en
+# un mensaje deja de mostrarse al llenarlo y al terminar se envía solo como PDF (ver enviar_resultado).
+async def responder_en_flujo(update: Update, user_action, texto, encabezado) -> None:
+    aviso = AVISO_PDF if ENVIAR_PDF and user_action in TITULOS_PDF else None
+    mensaje = MensajeEnFlujo(update.message, encabezado, aviso)
+    partes = []
+    async for fragmento in generar_en_flujo(user_action, texto, update.effective_chat.id):
+        partes.append(fragmento)
+        await mensaje.agregar(fragmento)
+    await mensaje.terminar()
+    if mensaje.lleno:
+        await enviar_resultado(update.get_bot(), update.effective_chat.id, user_action, "".join(partes).strip())
+
+# Responde un enlace de la app (/start <token>, ver enlaces.py) con el resultado que la app
+# generó por adelantado. Si aún no está listo se espera un momento y, si no llega o la app no pudo
+# generarlo, el bot lo genera.
+async def responder_enlace(update: Update, token) -> None:
+    enlace = await asyncio.to_thread(leer_enlace, db, token)
+    if enlace is None or enlace.get("tipo") not in ENCABEZADOS:
+        await update.message.reply_text("El enlace no es válido o ya expiró. Usa /start para ver las opciones.")
+        return
+
+    tipo, temas = enlace["tipo"], enlace["temas"]
+    resultado = enlace.get("resultado")
+    if resultado is None and not enlace.get("fallido"):
+        await update.message.reply_text("⏳ Preparando tu resultado...")
+        fin = asyncio.get_running_loop().time() + ESPERA_ENLACE
+        while resultado is None and asyncio.get_running_loop().time() < fin:
+            await asyncio.sleep(1)
+            enlace = await asyncio.to_thread(leer_enlace, db, token)
+            if enlace is None or enlace.get("fallido"):
+                break
+            resultado = enlace.get("resultado")
+
+    if resultado is not None:
+        await enviar_resultado(update.get_bot(), update.effective_chat.id, tipo, resultado)
+    else:
+        await responder_en_flujo(update, tipo, ", ".join(temas), ENCABEZADOS[tipo])
+
 # Comando /start
 async def start(update: Update, context) -> None:
     logging.info(f"/start ejecutado por {update.effective_user.username}")
 
+    if context.args:
+        await responder_enlace(update, context.args[0])
+        return
+
     keyboard = [
         [InlineKeyboardButton("Generar Resumen", callback_data="generar_resumen")],
         [InlineKeyboardButton("Generar Guía de Estudio", callback_data="generar_guia")],
@@ -137,20 +443,49 @@ async def handle_text(update: Update, context) -> None:
         await update.message.reply_text("Por favor, selecciona una opción usando /start antes de enviar un mensaje.")
         return
 
-    if user_action == 'resumen':
-        temas = update.message.text
-        resumen = generar_resumen(temas)
-        await update.message.reply_text(f"✅ Resumen generado:\n\n{resumen}")
-    elif user_action == 'guia':
-        temas = update.message.text
-        guia = generar_guia(temas)
-        await update.message.reply_text(f"📘 Guía de estudio generada:\n\n{guia}")
-    elif user_action == 'pregunta':
-        peticion = update.message.text
-        respuesta = responder_pregunta(peticion)
-        await update.message.reply_text(f"🤖 Respuesta:\n\n{respuesta}")
-
-    context.user_data['action'] = None  # Reiniciar acción del usuario
+    chat_id = update.effective_chat.id
+    # Se limpia la acción antes de generar para que los mensajes siguientes no la repitan
+    context.user_data['action'] = None
+
+    if user_action not in ENCABEZADOS:
+        return
+    # El límite se revisa antes de generar; al rechazar se conserva la acción para reenviar el mensaje
+    rechazo = await limitador.comprobar(chat_id)
+    if rechazo is not None:
+        context.user_data['action'] = user_action
+        await update.message.reply_text(mensaje_limite(*rechazo))
+        return
+    metricas.contar(f"peticiones_{user_action}")
+
+    with metricas.medir(f"respuesta_{user_action}"):
+        if USAR_COLA:
+            await encolar_peticion(user_action, update.message.text, chat_id)
+            await update.message.reply_text(MENSAJE_EN_COLA)
+            return
+
+        if RESPUESTA_EN_FLUJO:
+            await responder_en_flujo(update, user_action, update.message.text, ENCABEZADOS[user_action])
+            return
+
+        if user_action == 'resumen':
+            resultado = await generar_resumen(update.message.text, chat_id)
+        elif user_action == 'guia':
+            resultado = await generar_guia(update.message.text, chat_id)
+        else:
+            resultado = await responder_pregunta(update.message.text, chat_id)
+        if resultado is None:
+            await update.message.reply_text(MENSAJE_EN_COLA)
+        else:
+            await enviar_resultado(update.get_bot(), chat_id, user_action, resultado)
+
+# Comando /stats: latencias por etapa, aciertos de caché, cola y tokens. Solo para administradores.
+async def stats(update: Update, context) -> None:
+    if update.effective_user.id not in ADMINISTRADORES:
+        logging.warning(f"/stats rechazado para {update.effective_user.username}")
+        await update.message.reply_text("Este comando es solo para administradores.")
+        return
+    texto = await asyncio.to_thread(metricas.resumen)
+    await enviar_texto_largo(update.get_bot(), update.effective_chat.id, texto)
 
 # Manejar errores
 async def error_handler(update: Update, context) -> None:
@@ -158,25 +493,83 @@ async def error_handler(update: Update, context) -> None:
     if update:
         await update.message.reply_text("Ocurrió un error inesperado. Por favor, intenta de nuevo más tarde.")
 
-# Configura el bot
-if __name__ == '__main__':
-    if not TOKEN_BOT or not OPENAI_API_KEY:
-        logging.error("El token del bot o la clave de OpenAI no están configurados.")
-        exit(1)
+# Se ejecuta cuando la aplicación ya está inicializada, justo antes de recibir actualizaciones
+async def post_init(application) -> None:
+    global _tarea_entregas
+    _tarea_entregas = asyncio.create_task(entregar_resultados(application))
+    metricas.agregar_fuente("cola", lambda: profundidad_cola(db))
+    metricas.agregar_fuente("actualizaciones", lambda: {"en_cola": application.update_queue.qsize()})
+    if PUERTO_METRICAS:
+        from webhook import iniciar_servidor_metricas
+        global _servidor_metricas
+        _servidor_metricas = await iniciar_servidor_metricas(int(PUERTO_METRICAS))
+    # Las preguntas ya respondidas se cargan en segundo plano; mientras tanto solo se consultan las nuevas
+    asyncio.get_running_loop().run_in_executor(None, obtener_cache_preguntas().cargar)
+    logging.info(
+        f"Arranque: importación {_FIN_IMPORTACION - _INICIO:.3f} s, "
+        f"bot listo {time.perf_counter() - _INICIO:.3f} s"
+    )
+
+_tarea_entregas = None
+_servidor_metricas = None
 
-    application = ApplicationBuilder().token(TOKEN_BOT).build()
+# Se ejecuta al detener la aplicación
+async def post_stop(application) -> None:
+    if _tarea_entregas is not None:
+        _tarea_entregas.cancel()
+    if _servidor_metricas is not None:
+        await _servidor_metricas.cleanup()
+    renderizador.cerrar()
+
+# Construye la aplicación con todos los manejadores; la usan tanto polling como webhook
+def crear_aplicacion():
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN_BOT)
+        .concurrent_updates(ACTUALIZACIONES_CONCURRENTES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+    )
+    if PERSISTENCIA:
+        # user_data y chat_data en MongoDB, compartidos entre instancias del bot
+        from persistencia import PersistenciaMongo
+        builder = builder.persistence(PersistenciaMongo())
+    application = builder.build()
 
     # Añade los manejadores de comandos y mensajes
-    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("start", start, block=False))
     application.add_handler(CommandHandler("resumen", resumen))
     application.add_handler(CommandHandler("guia", guia))
     application.add_handler(CommandHandler("pregunta", pregunta))
+    application.add_handler(CommandHandler("stats", stats, block=False))
     application.add_handler(CallbackQueryHandler(handle_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    # block=False: cada generación corre como tarea propia y no detiene el resto de actualizaciones
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text, block=False))
 
     # Añade el manejador de errores
     application.add_error_handler(error_handler)
+    return application
+
+# Configura el bot
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bot de Telegram del asistente educativo.")
+    parser.add_argument("--webhook", action="store_true", help="recibir actualizaciones por webhook en lugar de polling")
+    parser.add_argument("--sin-registrar", action="store_true", help="no llamar a setWebhook (pruebas locales)")
+    args = parser.parse_args()
+
+    if not TOKEN_BOT or not OPENAI_API_KEY:
+        logging.error("El token del bot o la clave de OpenAI no están configurados.")
+        exit(1)
+
+    # Índices de las colecciones que usa el bot (idempotente)
+    asegurar_indices()
+
+    application = crear_aplicacion()
 
     # Inicia el bot
     logging.info("El bot se está ejecutando...")
-    application.run_polling()
+    if args.webhook:
+        from webhook import ejecutar_webhook
+        asyncio.run(ejecutar_webhook(application, registrar=not args.sin_registrar))
+    else:
+        application.run_polling()
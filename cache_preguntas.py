@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from cache_resultados import normalizar_tema
+from metricas import metricas
+
+# Similitud de Jaccard mínima entre dos preguntas para reutilizar la respuesta
+UMBRAL = float(os.getenv("PREGUNTAS_UMBRAL", "0.8"))
+# Preguntas que se mantienen en memoria; al pasar el límite se descartan las menos usadas
+CAPACIDAD = int(os.getenv("PREGUNTAS_CAPACIDAD", "20000"))
+# Palabras clave mínimas para guardar o reutilizar una respuesta: con menos, dos preguntas
+# distintas quedan iguales ("¿Qué es la mitosis?" solo conserva "mitosis")
+MIN_PALABRAS = int(os.getenv("PREGUNTAS_MIN_PALABRAS", "2"))
+# Vigencia en MongoDB desde el último uso (índice TTL de la colección)
+TTL_MONGO = int(os.getenv("PREGUNTAS_TTL_MONGO", str(30 * 24 * 60 * 60)))
+
+# Firma MinHash de 32 valores agrupada en 8 bandas de 4 para el índice LSH: dos preguntas con
+# similitud 0.8 comparten alguna banda con probabilidad ~0.98, y con 0.4 solo ~0.19
+PERMUTACIONES = 32
+FILAS_POR_BANDA = 4
+_PRIMO = (1 << 61) - 1
+# Semilla fija: las firmas deben ser iguales en todos los procesos
+_aleatorio = random.Random(20240601)
+_COEFICIENTES = [(_aleatorio.randrange(1, _PRIMO), _aleatorio.randrange(0, _PRIMO)) for _ in range(PERMUTACIONES)]
+
+# Palabras que no distinguen una pregunta de otra
+PALABRAS_VACIAS = frozenset("""
+a al algo ante con de del dime el ella en entre es esta este explica explicame favor hay la las le
+lo los me mi muy o para pero por puedes se ser si sobre son su sus te tu un una uno unos y ya
+""".split())
+
+# Palabras interrogativas y de negación: cambian el sentido de la pregunta ("¿por qué...?" frente a
+# "¿dónde...?", "¿es...?" frente a "¿no es...?"), así que se guardan aparte y deben coincidir todas
+MARCAS = frozenset("""
+como cual cuales cuando cuanto cuanta cuantos cuantas donde paraque porque que quien quienes
+jamas ni ningun ninguna ninguno no nunca sin tampoco
+""".split())
+
+# Rasgos de una pregunta: (palabras, marcas). Las palabras son las significativas, sin acentos,
+# signos ni palabras vacías y con el plural simple recortado ("leyes" y "ley" cuentan igual);
+# las marcas son las interrogativas y negaciones que aparecen ("por qué" cuenta como "porque").
+def rasgos_pregunta(pregunta):
+    texto = re.sub(r"\b(por|para)\s+que\b", r"\1que", normalizar_tema(pregunta))
+    palabras, marcas = set(), set()
+    for palabra in re.findall(r"\w+", texto):
+        if palabra in MARCAS:
+            marcas.add(palabra)
+            continue
+        if palabra in PALABRAS_VACIAS:
+            continue
+        if len(palabra) > 4 and palabra.endswith("es"):
+            palabra = palabra[:-2]
+        elif len(palabra) > 3 and palabra.endswith("s"):
+            palabra = palabra[:-1]
+        palabras.add(palabra)
+    return frozenset(palabras), frozenset(marcas)
+
+def firma_minhash(palabras):
+    hashes = [zlib.crc32(palabra.encode("utf-8")) for palabra in palabras]
+    return tuple(min((a * h + b) % _PRIMO for h in hashes) for a, b in _COEFICIENTES)
+
+# Las bandas incluyen las marcas: solo son candidatas las preguntas con las mismas marcas
+def _bandas(marcas, firma):
+    return [(marcas, i, firma[i:i + FILAS_POR_BANDA]) for i in range(0, PERMUTACIONES, FILAS_POR_BANDA)]
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def clave_pregunta(palabras, marcas):
+    datos = " ".join(sorted(palabras)) + "|" + " ".join(sorted(marcas))
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+# Caché de preguntas casi repetidas para /pregunta.
+# La búsqueda es solo en memoria: las bandas de la firma MinHash indexan las preguntas guardadas y
+# solo los candidatos que comparten una banda (y por tanto las marcas) se comparan con la
+# similitud de Jaccard exacta.
+# Las respuestas se guardan en MongoDB para compartirlas entre instancias y reiniciar con la
+# caché llena; en memoria se conservan las CAPACIDAD usadas más recientemente.
+class CachePreguntas:
+    def __init__(self, coleccion=None, umbral=UMBRAL, capacidad=CAPACIDAD):
+        self.coleccion = coleccion
+        self.umbral = umbral
+        self.capacidad = capacidad
+        # clave -> (palabras, marcas, firma, respuesta), en orden de uso
+        self._entradas = OrderedDict()
+        self._bandas = {}
+        self._lock = threading.Lock()
+        self._cargada = False
+        self._indice_creado = False
+        self.contadores = {"aciertos": 0, "fallos": 0, "guardadas": 0, "descartadas": 0}
+
+    def _asegurar_indice(self):
+        if self._indice_creado or self.coleccion is None:
+            return
+        try:
+            self.coleccion.create_index("usado", expireAfterSeconds=TTL_MONGO)
+            self._indice_creado = True
+        except Exception as e:
+            logging.warning(f"No se pudo crear el índice TTL de la caché de preguntas: {e}")
+
+    # Lee de MongoDB las preguntas usadas más recientemente; se llama una vez, fuera del bucle de eventos.
+    def cargar(self):
+        if self._cargada or self.coleccion is None:
+            return
+        self._cargada = True
+        try:
+            documentos = list(
+                self.coleccion.find({}, {"palabras": 1, "marcas": 1, "respuesta": 1})
+                .sort("usado", -1).limit(self.capacidad)
+            )
+        except Exception as e:
+            logging.warning(f"Error al cargar la caché de preguntas: {e}")
+            return
+        for documento in reversed(documentos):
+            palabras = frozenset(documento.get("palabras", []))
+            if len(palabras) >= MIN_PALABRAS:
+                self._agregar(documento["_id"], palabras, frozenset(documento.get("marcas", [])), documento["respuesta"])
+        logging.info(f"Caché de preguntas cargada: {len(self._entradas)} preguntas")
+
+    def _agregar(self, clave, palabras, marcas, respuesta):
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas[clave] = self._entradas[clave][:3] + (respuesta,)
+                self._entradas.move_to_end(clave)
+                return
+            firma = firma_minhash(palabras)
+            self._entradas[clave] = (palabras, marcas, firma, respuesta)
+            for banda in _bandas(marcas, firma):
+                self._bandas.setdefault(banda, set()).add(clave)
+            while len(self._entradas) > self.capacidad:
+                self._descartar_mas_antigua()
+
+    def _descartar_mas_antigua(self):
+        clave, (_, marcas, firma, _) = self._entradas.popitem(last=False)
+        for banda in _bandas(marcas, firma):
+            claves = self._bandas.get(banda)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._bandas[banda]
+        self.contadores["descartadas"] += 1
+
+    # Busca una pregunta parecida con las mismas marcas; devuelve (clave, respuesta) o None.
+    # No hace operaciones de red.
+    def buscar(self, pregunta):
+        palabras, marcas = rasgos_pregunta(pregunta)
+        if len(palabras) < MIN_PALABRAS:
+            return None
+        firma = firma_minhash(palabras)
+        with self._lock:
+            candidatas = set()
+            for banda in _bandas(marcas, firma):
+                candidatas.update(self._bandas.get(banda, ()))
+            mejor, similitud = None, self.umbral
+            for clave in candidatas:
+                if self._entradas[clave][1] != marcas:
+                    continue
+                similitud_actual = jaccard(palabras, self._entradas[clave][0])
+                if similitud_actual >= similitud:
+                    mejor, similitud = clave, similitud_actual
+            if mejor is None:
+                self.contadores["fallos"] += 1
+                return None
+            self._entradas.move_to_end(mejor)
+            self.contadores["aciertos"] += 1
+            return mejor, self._entradas[mejor][3]
+
+    def guardar(self, pregunta, respuesta):
+        palabras, marcas = rasgos_pregunta(pregunta)
+        if len(palabras) < MIN_PALABRAS:
+            return
+        clave = clave_pregunta(palabras, marcas)
+        self._agregar(clave, palabras, marcas, respuesta)
+        with self._lock:
+            self.contadores["guardadas"] += 1
+        if self.coleccion is None:
+            return
+        self._asegurar_indice()
+        try:
+            self.coleccion.replace_one(
+                {"_id": clave},
+                {"palabras": sorted(palabras), "marcas": sorted(marcas), "pregunta": pregunta, "respuesta": respuesta, "usado": datetime.now(timezone.utc)},
+                upsert=True
+            )
+        except Exception as e:
+            logging.warning(f"Error al guardar en la caché de preguntas: {e}")
+
+    # Renueva la vigencia en MongoDB de una pregunta reutilizada
+    def renovar(self, clave):
+        if self.coleccion is None:
+            return
+        try:
+            self.coleccion.update_one({"_id": clave}, {"$set": {"usado": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logging.warning(f"Error al renovar la caché de preguntas: {e}")
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self.contadores)
+            datos["en_memoria"] = len(self._entradas)
+        consultas = datos["aciertos"] + datos["fallos"]
+        datos["tasa_aciertos"] = datos["aciertos"] / consultas if consultas else 0.0
+        return datos
+
+_cache = None
+
+# Caché de preguntas del proceso, ligada a la colección db.cache_preguntas
+def obtener_cache_preguntas():
+    global _cache
+    if _cache is None:
+        from base_datos import db
+        _cache = CachePreguntas(db.cache_preguntas)
+        metricas.agregar_fuente("cache_preguntas", _cache.estadisticas)
+    return _cache
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from metricas import metricas
+
+# Tamaño y vigencia de la caché en memoria
+CAPACIDAD_MEMORIA = int(os.getenv("CACHE_CAPACIDAD", "256"))
+TTL_MEMORIA = int(os.getenv("CACHE_TTL_MEMORIA", str(60 * 60)))
+# Vigencia de los resultados guardados en MongoDB (índice TTL de la colección)
+TTL_MONGO = int(os.getenv("CACHE_TTL_MONGO", str(7 * 24 * 60 * 60)))
+
+# Normaliza un tema: sin acentos, en minúsculas y con espacios simples
+def normalizar_tema(tema):
+    texto = unicodedata.normalize("NFKD", str(tema))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"\s+", " ", texto.lower()).strip(" .;:")
+    return texto
+
+# Convierte una lista de temas (o el texto enviado al bot) en un conjunto ordenado y sin duplicados
+def normalizar_temas(temas):
+    if isinstance(temas, str):
+        temas = re.split(r"[,;\n]+", temas)
+    return tuple(sorted({normalizar_tema(t) for t in temas if normalizar_tema(t)}))
+
+# Clave de caché a partir de (tipo, modelo, conjunto de temas, max_tokens)
+def clave_cache(tipo, modelo, temas, max_tokens):
+    datos = json.dumps([tipo, modelo, normalizar_temas(temas), max_tokens], ensure_ascii=False)
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+# Caché de dos niveles para resúmenes y guías:
+# un LRU con vigencia en el proceso y una colección de MongoDB compartida entre la app y el bot.
+class CacheResultados:
+    def __init__(self, coleccion=None, capacidad=CAPACIDAD_MEMORIA, ttl=TTL_MEMORIA):
+        self.coleccion = coleccion
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._indice_creado = False
+        self.contadores = {"aciertos_memoria": 0, "aciertos_mongo": 0, "fallos": 0, "guardados": 0}
+
+    def _contar(self, nombre):
+        with self._lock:
+            self.contadores[nombre] += 1
+
+    def _asegurar_indice(self):
+        if self._indice_creado or self.coleccion is None:
+            return
+        try:
+            self.coleccion.create_index("creado", expireAfterSeconds=TTL_MONGO)
+            self._indice_creado = True
+        except Exception as e:
+            logging.warning(f"No se pudo crear el índice TTL de la caché: {e}")
+
+    # Busca solo en memoria; no hace operaciones de red
+    def obtener_memoria(self, clave):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is None:
+                return None
+            texto, expira = entrada
+            if expira < time.monotonic():
+                del self._memoria[clave]
+                return None
+            self._memoria.move_to_end(clave)
+            self.contadores["aciertos_memoria"] += 1
+            return texto
+
+    def _guardar_memoria(self, clave, texto):
+        with self._lock:
+            self._memoria[clave] = (texto, time.monotonic() + self.ttl)
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.capacidad:
+                self._memoria.popitem(last=False)
+
+    # Busca en memoria y después en MongoDB; un acierto en MongoDB se sube a memoria
+    def obtener(self, clave):
+        texto = self.obtener_memoria(clave)
+        if texto is not None:
+            return texto
+        if self.coleccion is not None:
+            try:
+                documento = self.coleccion.find_one({"_id": clave}, {"texto": 1})
+            except Exception as e:
+                logging.warning(f"Error al consultar la caché en MongoDB: {e}")
+                documento = None
+            if documento:
+                self._guardar_memoria(clave, documento["texto"])
+                self._contar("aciertos_mongo")
+                return documento["texto"]
+        self._contar("fallos")
+        return None
+
+    def guardar(self, clave, texto, **metadatos):
+        self._guardar_memoria(clave, texto)
+        self._contar("guardados")
+        if self.coleccion is None:
+            return
+        self._asegurar_indice()
+        try:
+            self.coleccion.replace_one(
+                {"_id": clave},
+                {"texto": texto, "creado": datetime.now(timezone.utc), **metadatos},
+                upsert=True
+            )
+        except Exception as e:
+            logging.warning(f"Error al guardar en la caché de MongoDB: {e}")
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self.contadores)
+            datos["en_memoria"] = len(self._memoria)
+        consultas = datos["aciertos_memoria"] + datos["aciertos_mongo"] + datos["fallos"]
+        datos["tasa_aciertos"] = (datos["aciertos_memoria"] + datos["aciertos_mongo"]) / consultas if consultas else 0.0
+        return datos
+
+_cache = None
+
+# Caché compartida del proceso, ligada a la colección db.cache_resultados
+def obtener_cache():
+    global _cache
+    if _cache is None:
+        from base_datos import db
+        _cache = CacheResultados(db.cache_resultados)
+        metricas.agregar_fuente("cache_resultados", _cache.estadisticas)
+    return _cache
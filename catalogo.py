@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# Copia local del catálogo (semestres, materias y temas) para abrir la malla sin esperar a MongoDB
+ARCHIVO = os.getenv("CATALOGO_ARCHIVO", os.path.join(os.path.expanduser("~"), ".bee_app", "catalogo.json"))
+# Documento de db.catalogo_meta con la versión vigente del catálogo
+ID_VERSION = "catalogo"
+
+# Orden de semestres igual al $sort de MongoDB: nulos, números y después textos
+def _orden_semestre(semestre):
+    if semestre is None:
+        return (0, 0, "")
+    if isinstance(semestre, (int, float)):
+        return (1, semestre, "")
+    return (2, 0, str(semestre))
+
+# Versión publicada del catálogo en MongoDB; None si nunca se ha publicado
+def version_remota(db):
+    documento = db.catalogo_meta.find_one({"_id": ID_VERSION}, {"version": 1})
+    return documento.get("version") if documento else None
+
+# Publica una nueva versión del catálogo; se llama después de modificar db.materias
+def publicar_version(db):
+    version = datetime.now(timezone.utc).isoformat()
+    db.catalogo_meta.update_one({"_id": ID_VERSION}, {"$set": {"version": version}}, upsert=True)
+    return version
+
+class CatalogoLocal:
+    def __init__(self, archivo=ARCHIVO):
+        self.archivo = archivo
+        self.version = None
+        self._semestres = []
+        self._temas = {}
+        self._lock = threading.Lock()
+
+    @property
+    def disponible(self):
+        return bool(self._semestres)
+
+    # Lee la copia local; devuelve False si no existe o está dañada
+    def cargar(self):
+        try:
+            with open(self.archivo, encoding="utf-8") as archivo:
+                datos = json.load(archivo)
+        except (OSError, ValueError):
+            return False
+        self._aplicar(datos)
+        return True
+
+    def _aplicar(self, datos):
+        with self._lock:
+            self.version = datos.get("version")
+            self._semestres = [(s["semestre"], s["materias"]) for s in datos.get("semestres", [])]
+            self._temas = datos.get("temas", {})
+
+    # Lista de (semestre, [materias]) en el mismo orden que el aggregate de la malla
+    def semestres(self):
+        with self._lock:
+            return list(self._semestres)
+
+    # Temas de una materia o None si la materia no está en la copia local
+    def temas(self, materia):
+        with self._lock:
+            return self._temas.get(materia)
+
+    # Descarga el catálogo completo con una sola consulta
+    def descargar(self, db, version):
+        grupos = {}
+        temas = {}
+        for documento in db.materias.find({}, {"_id": 0, "nombre": 1, "semestre": 1, "temas.numero": 1, "temas.titulo": 1}):
+            nombre = documento.get("nombre")
+            grupos.setdefault(documento.get("semestre"), []).append(nombre)
+            if nombre is not None:
+                temas[str(nombre)] = documento.get("temas", [])
+        return {
+            "version": version,
+            "semestres": [
+                {"semestre": semestre, "materias": grupos[semestre]}
+                for semestre in sorted(grupos, key=_orden_semestre)
+            ],
+            "temas": temas
+        }
+
+    def guardar(self, datos):
+        os.makedirs(os.path.dirname(self.archivo) or ".", exist_ok=True)
+        temporal = f"{self.archivo}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(datos, archivo, ensure_ascii=False, separators=(",", ":"), default=str)
+        os.replace(temporal, self.archivo)
+
+    # Compara la versión local con la de MongoDB y descarga el catálogo solo si cambió.
+    # Si nunca se ha publicado una versión, se descarga siempre. Devuelve True si hubo cambios.
+    def actualizar_si_cambio(self, db):
+        version = version_remota(db)
+        if version is not None and version == self.version and self.disponible:
+            return False
+        datos = self.descargar(db, version)
+        self.guardar(datos)
+        self._aplicar(datos)
+        return True
+
+catalogo = CatalogoLocal()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Administra la versión del catálogo de materias.")
+    parser.add_argument("--publicar", action="store_true", help="publica una nueva versión para que las apps se actualicen")
+    args = parser.parse_args()
+
+    from base_datos import db
+    if args.publicar:
+        print(f"Versión publicada: {publicar_version(db)}")
+    else:
+        print(f"Versión actual: {version_remota(db)}")
@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+# Carga las variables de entorno
+load_dotenv()
+
+# Las preguntas cortas se atienden antes que los resúmenes y las guías
+PRIORIDADES = {"pregunta": 0, "resumen": 1, "guia": 2}
+# Reintentos ante límites de uso o tiempos agotados antes de marcar el trabajo como fallido
+MAX_INTENTOS = int(os.getenv("COLA_MAX_INTENTOS", "6"))
+# Espera base y máxima (segundos) del retroceso exponencial
+ESPERA_BASE = float(os.getenv("COLA_ESPERA_BASE", "2"))
+ESPERA_MAXIMA = float(os.getenv("COLA_ESPERA_MAXIMA", "120"))
+# Segundos que un trabajador reserva un trabajo; si muere, otro lo retoma al vencer
+RESERVA = int(os.getenv("COLA_RESERVA", "180"))
+# Segundos de espera de un trabajador cuando la cola está vacía
+ESPERA_VACIA = float(os.getenv("COLA_ESPERA_VACIA", "1"))
+# Segundos que se conserva un trabajo terminado o fallido (índice TTL de "terminado")
+VIGENCIA_TRABAJOS = int(os.getenv("COLA_VIGENCIA", str(7 * 24 * 60 * 60)))
+# Cada trabajador registra en db.trabajadores que sigue vivo cada LATIDO segundos; se le
+# considera detenido si no lo hace en INACTIVIDAD segundos (índice TTL de "visto")
+LATIDO = float(os.getenv("COLA_LATIDO", "10"))
+INACTIVIDAD = int(3 * LATIDO)
+
+def _ahora():
+    return datetime.now(timezone.utc)
+
+# Una solicitud a OpenAI dentro de un trabajo. Con temas, el texto se guarda también en la caché
+# de resultados con la misma clave que usa quien genera ese grupo de temas en el momento.
+def parte_trabajo(sistema, prompt, max_tokens, temas=None):
+    return {"sistema": sistema, "prompt": prompt, "max_tokens": max_tokens, "temas": temas}
+
+# Agrega un trabajo de generación a db.trabajos y devuelve su id.
+# partes son las solicitudes del trabajo (ver parte_trabajo): un resumen o guía de muchos temas
+# lleva una por grupo de presupuesto.dividir_temas y el resultado es su unión en orden.
+# destino indica a quién se entrega: {"canal": "telegram", "chat_id": ...} o {"canal": "app"}.
+def encolar(db, tipo, partes, destino):
+    ahora = _ahora()
+    resultado = db.trabajos.insert_one({
+        "tipo": tipo,
+        "prioridad": PRIORIDADES.get(tipo, 1),
+        "partes": partes,
+        "resultados": [None] * len(partes),
+        "destino": destino,
+        "estado": "pendiente",
+        "intentos": 0,
+        "disponible_en": ahora,
+        "creado": ahora,
+        "entregado": False
+    })
+    return resultado.inserted_id
+
+# Reserva el siguiente trabajo disponible, por prioridad y antigüedad.
+# También retoma trabajos cuya reserva venció (el trabajador que los tenía se detuvo).
+def tomar_trabajo(db, trabajador):
+    from pymongo import ReturnDocument
+    ahora = _ahora()
+    return db.trabajos.find_one_and_update(
+        {"$or": [
+            {"estado": "pendiente", "disponible_en": {"$lte": ahora}},
+            {"estado": "en_proceso", "reservado_hasta": {"$lt": ahora}}
+        ]},
+        {"$set": {"estado": "en_proceso", "trabajador": trabajador, "reservado_hasta": ahora + timedelta(seconds=RESERVA)}},
+        sort=[("prioridad", 1), ("creado", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+# Errores pasajeros de OpenAI que vale la pena reintentar
+def es_reintentable(error):
+    import openai
+    if isinstance(error, (
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain,
+        asyncio.TimeoutError
+    )):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+
+# Retroceso exponencial con "full jitter": espera aleatoria entre 0 y base * 2^intento (con tope).
+# Si OpenAI indica Retry-After, se espera al menos eso.
+def calcular_espera(intentos, error=None):
+    espera = random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * (2 ** intentos)))
+    cabeceras = getattr(error, "headers", None) or {}
+    try:
+        espera = max(espera, float(cabeceras.get("retry-after", 0)))
+    except (TypeError, ValueError):
+        pass
+    return espera
+
+def _generar(parte):
+    from generacion import completar_sincrono
+    return completar_sincrono(parte["sistema"], parte["prompt"], parte["max_tokens"])
+
+def _guardar_en_cache(tipo, parte, texto):
+    if parte.get("temas") is None or tipo not in ("resumen", "guia"):
+        return
+    from cache_resultados import clave_cache, obtener_cache
+    from generacion import MODELO
+    clave = clave_cache(tipo, MODELO, parte["temas"], parte["max_tokens"])
+    obtener_cache().guardar(clave, texto, tipo=tipo, modelo=MODELO)
+
+# Ejecuta un trabajo reservado y guarda su resultado, lo reprograma o lo marca como fallido.
+# Cada parte terminada se guarda al momento, así un reintento solo repite las que faltan.
+def procesar(db, trabajo):
+    partes = trabajo["partes"]
+    resultados = list(trabajo.get("resultados") or [None] * len(partes))
+    try:
+        for numero, parte in enumerate(partes):
+            if resultados[numero] is not None:
+                continue
+            resultados[numero] = _generar(parte)
+            db.trabajos.update_one({"_id": trabajo["_id"]}, {"$set": {f"resultados.{numero}": resultados[numero]}})
+            _guardar_en_cache(trabajo["tipo"], parte, resultados[numero])
+    except Exception as e:
+        intentos = trabajo.get("intentos", 0) + 1
+        if es_reintentable(e) and intentos < MAX_INTENTOS:
+            espera = calcular_espera(intentos, e)
+            logging.warning(f"Trabajo {trabajo['_id']}: {e}; reintento {intentos} en {espera:.1f}s")
+            db.trabajos.update_one(
+                {"_id": trabajo["_id"]},
+                {"$set": {"estado": "pendiente", "intentos": intentos, "disponible_en": _ahora() + timedelta(seconds=espera)}}
+            )
+        else:
+            logging.error(f"Trabajo {trabajo['_id']} fallido tras {intentos} intentos: {e}")
+            db.trabajos.update_one(
+                {"_id": trabajo["_id"]},
+                {"$set": {"estado": "fallido", "intentos": intentos, "error": str(e), "terminado": _ahora()}}
+            )
+        return
+
+    db.trabajos.update_one(
+        {"_id": trabajo["_id"]},
+        {"$set": {"estado": "terminado", "resultado": "\n\n".join(resultados), "terminado": _ahora()}}
+    )
+
+# Registra que el trabajador sigue vivo
+def latir(db, nombre):
+    db.trabajadores.update_one({"_id": nombre}, {"$set": {"visto": _ahora()}}, upsert=True)
+
+# Indica si algún trabajador dio señales de vida hace poco; sin ninguno, encolar solo deja
+# esperando a quien pide el resultado
+def hay_trabajador(db):
+    return db.trabajadores.count_documents({"visto": {"$gte": _ahora() - timedelta(seconds=INACTIVIDAD)}}, limit=1) > 0
+
+# Late en un hilo aparte para que una generación larga no haga parecer detenido al trabajador
+def _latir_mientras(db, nombre, detener):
+    while not detener.is_set():
+        try:
+            latir(db, nombre)
+        except Exception as e:
+            logging.error(f"Error al registrar el latido de {nombre}: {e}")
+        detener.wait(LATIDO)
+
+# Bucle de un proceso trabajador
+def trabajar(nombre, detener):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from base_datos import obtener_db
+    db = obtener_db()
+    threading.Thread(target=_latir_mientras, args=(db, nombre, detener), daemon=True).start()
+    logging.info(f"Trabajador {nombre} iniciado")
+    while not detener.is_set():
+        try:
+            trabajo = tomar_trabajo(db, nombre)
+        except Exception as e:
+            logging.error(f"Error al consultar la cola: {e}")
+            trabajo = None
+        if trabajo is None:
+            detener.wait(ESPERA_VACIA)
+            continue
+        procesar(db, trabajo)
+    logging.info(f"Trabajador {nombre} detenido")
+
+# Espera (bloqueando) a que un trabajo termine. Devuelve el texto o lanza RuntimeError si falló.
+# Pensada para usarse desde un hilo en segundo plano de la app de escritorio.
+def esperar_resultado(db, trabajo_id, tiempo_limite=600, cancelacion=None, intervalo=1.0):
+    fin = time.monotonic() + tiempo_limite
+    while time.monotonic() < fin:
+        if cancelacion is not None and cancelacion.is_set():
+            return None
+        trabajo = db.trabajos.find_one({"_id": trabajo_id}, {"estado": 1, "resultado": 1, "error": 1})
+        if trabajo and trabajo["estado"] == "terminado":
+            db.trabajos.update_one({"_id": trabajo_id}, {"$set": {"entregado": True}})
+            return trabajo["resultado"]
+        if trabajo and trabajo["estado"] == "fallido":
+            db.trabajos.update_one({"_id": trabajo_id}, {"$set": {"entregado": True}})
+            raise RuntimeError(trabajo.get("error", "El trabajo falló"))
+        time.sleep(intervalo)
+    raise TimeoutError("El trabajo no terminó a tiempo")
+
+# Trabajos pendientes y en proceso, para las métricas
+def profundidad_cola(db):
+    return {estado: db.trabajos.count_documents({"estado": estado}) for estado in ("pendiente", "en_proceso")}
+
+# Reclama el siguiente trabajo terminado (o fallido) para un canal que aún no se ha entregado
+def reclamar_entrega(db, canal):
+    return db.trabajos.find_one_and_update(
+        {"estado": {"$in": ["terminado", "fallido"]}, "destino.canal": canal, "entregado": False},
+        {"$set": {"entregado": True}},
+        {"tipo": 1, "destino": 1, "estado": 1, "resultado": 1}
+    )
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Procesos trabajadores de la cola de generación.")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 2, help="número de procesos trabajadores")
+    args = parser.parse_args()
+
+    from base_datos import asegurar_indices
+    asegurar_indices()
+
+    detener = multiprocessing.Event()
+    signal.signal(signal.SIGTERM, lambda senal, marco: detener.set())
+    procesos = [
+        multiprocessing.Process(target=trabajar, args=(f"{socket.gethostname()}-{os.getpid()}-{i}", detener))
+        for i in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        logging.info("Deteniendo trabajadores...")
+        detener.set()
+        for proceso in procesos:
+            proceso.join()
@@ -0,0 +1,221 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Sesión guardada en el equipo para entrar sin volver a escribir la contraseña
+ARCHIVO_SESION = os.getenv("SESION_ARCHIVO", os.path.join(os.path.expanduser("~"), ".bee_app", "sesion.json"))
+# Días de vigencia de una sesión
+VIGENCIA_SESION = int(os.getenv("SESION_DIAS", "30")) * 24 * 60 * 60
+# Usuarios por lote en la migración de contraseñas
+LOTE_MIGRACION = int(os.getenv("MIGRACION_LOTE", "200"))
+
+# Prefijo de los hashes actuales (passlib pbkdf2_sha256)
+_PREFIJO_PBKDF2 = "$pbkdf2-sha256$"
+# Hashes antiguos que no se pueden recalcular sin la contraseña: crypt ($...$) o resúmenes hexadecimales
+_HASH_ANTIGUO = re.compile(r"^(\$.+\$.+|[0-9a-fA-F]{32}|[0-9a-fA-F]{40}|[0-9a-fA-F]{64}|[0-9a-fA-F]{128})$")
+
+# Función para hashear contraseñas
+def hash_password(password):
+    from passlib.hash import pbkdf2_sha256  # Reemplazo de hashlib
+    return pbkdf2_sha256.hash(password)
+
+# Verificar contraseña, con manejo mejorado de errores
+def verify_password(password, hashed):
+    from passlib.hash import pbkdf2_sha256
+    try:
+        if pbkdf2_sha256.verify(password, hashed):
+            return True
+    except ValueError:
+        print("El formato del hash no es válido. Probablemente la contraseña no está hasheada.")
+    except Exception as e:
+        print(f"Error al verificar la contraseña: {e}")
+    return False
+
+# ---------------------------------------------------------------------------
+# Sesiones
+# Un token de sesión lleva el correo y la fecha de vencimiento firmados con HMAC. Al abrir la app
+# se comprueba la firma y el vencimiento en local y después se busca su huella en db.sesiones
+# (una consulta por _id), así que un usuario que vuelve no pasa por PBKDF2. Borrar el documento
+# revoca la sesión; el índice TTL de "expira" limpia las vencidas.
+# ---------------------------------------------------------------------------
+
+_clave = None
+
+# Clave de firma: SESION_SECRETO o, si no está definida, una clave aleatoria del equipo
+def _clave_firma():
+    global _clave
+    if _clave is None:
+        secreto = os.getenv("SESION_SECRETO")
+        if secreto:
+            _clave = secreto.encode("utf-8")
+        else:
+            archivo = os.path.join(os.path.dirname(ARCHIVO_SESION) or ".", "clave_sesion")
+            try:
+                with open(archivo, "rb") as entrada:
+                    _clave = entrada.read()
+            except OSError:
+                _clave = b""
+            if len(_clave) < 32:
+                _clave = secrets.token_bytes(32)
+                os.makedirs(os.path.dirname(archivo) or ".", exist_ok=True)
+                with open(archivo, "wb") as salida:
+                    salida.write(_clave)
+    return _clave
+
+def _b64(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode("ascii")
+
+def _desde_b64(texto):
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+def _firmar(carga):
+    return _b64(hmac.new(_clave_firma(), carga.encode("ascii"), hashlib.sha256).digest())
+
+# El token no se guarda en MongoDB, solo su huella
+def huella_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+# Crea una sesión para un usuario ya verificado y devuelve el token
+def crear_sesion(db, correo, vigencia=VIGENCIA_SESION):
+    expira = int(time.time()) + vigencia
+    carga = _b64(json.dumps({"c": correo, "e": expira, "n": secrets.token_urlsafe(12)}).encode("utf-8"))
+    token = f"{carga}.{_firmar(carga)}"
+    db.sesiones.insert_one({
+        "_id": huella_token(token),
+        "correo": correo,
+        "creada": datetime.now(timezone.utc),
+        "expira": datetime.fromtimestamp(expira, timezone.utc)
+    })
+    return token
+
+# Correo de la sesión si la firma es válida y no ha vencido; no consulta MongoDB
+def leer_token(token):
+    try:
+        carga, firma = token.split(".")
+        if not hmac.compare_digest(firma, _firmar(carga)):
+            return None
+        datos = json.loads(_desde_b64(carga))
+    except (ValueError, AttributeError):
+        return None
+    if datos.get("e", 0) <= time.time():
+        return None
+    return datos.get("c")
+
+# Correo de la sesión si el token es válido y la sesión sigue en MongoDB; None en otro caso
+def validar_sesion(db, token):
+    correo = leer_token(token)
+    if correo is None:
+        return None
+    sesion = db.sesiones.find_one({"_id": huella_token(token)}, {"correo": 1})
+    if sesion is None or sesion.get("correo") != correo:
+        return None
+    return correo
+
+def cerrar_sesion(db, token):
+    db.sesiones.delete_one({"_id": huella_token(token)})
+
+def guardar_sesion_local(token, archivo=ARCHIVO_SESION):
+    os.makedirs(os.path.dirname(archivo) or ".", exist_ok=True)
+    temporal = f"{archivo}.tmp"
+    with open(temporal, "w", encoding="utf-8") as salida:
+        json.dump({"token": token}, salida)
+    os.replace(temporal, archivo)
+
+def leer_sesion_local(archivo=ARCHIVO_SESION):
+    try:
+        with open(archivo, encoding="utf-8") as entrada:
+            return json.load(entrada).get("token")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def borrar_sesion_local(archivo=ARCHIVO_SESION):
+    try:
+        os.remove(archivo)
+    except OSError:
+        pass
+
+# ---------------------------------------------------------------------------
+# Migración de contraseñas
+# Rehashea de una vez, fuera de la app, las contraseñas de db.usuarios que siguen en texto plano.
+# El hash se calcula en un grupo de procesos (PBKDF2 ocupa la CPU) y cada lote se escribe con un
+# solo bulk_write. La actualización exige que la contraseña no haya cambiado mientras tanto.
+# ---------------------------------------------------------------------------
+
+# Clasifica el valor guardado: "actual", "antiguo" (hash de otro formato) o "texto"
+def formato_contrasena(valor):
+    if not isinstance(valor, str) or not valor:
+        return "antiguo"
+    if valor.startswith(_PREFIJO_PBKDF2):
+        return "actual"
+    if _HASH_ANTIGUO.match(valor):
+        return "antiguo"
+    return "texto"
+
+# Se ejecuta en los procesos del grupo: [(id, contraseña)] -> [(id, contraseña, hash)]
+def _hashear_lote(lote):
+    return [(identificador, valor, hash_password(valor)) for identificador, valor in lote]
+
+def migrar_contrasenas(db, procesos=None, lote=LOTE_MIGRACION, simular=False):
+    from pymongo import UpdateOne
+    resumen = {"revisadas": 0, "migradas": 0, "sin_migrar": 0, "cambiadas": 0}
+    pendientes = []
+    cursor = db.usuarios.find(
+        {"contraseña": {"$not": re.compile("^" + re.escape(_PREFIJO_PBKDF2))}},
+        {"contraseña": 1}
+    )
+    for usuario in cursor:
+        resumen["revisadas"] += 1
+        valor = usuario.get("contraseña")
+        if formato_contrasena(valor) == "antiguo":
+            resumen["sin_migrar"] += 1
+            logging.warning(f"Usuario {usuario['_id']}: hash en formato antiguo, debe restablecer su contraseña")
+        else:
+            pendientes.append((usuario["_id"], valor))
+    resumen["por_migrar"] = len(pendientes)
+    if simular or not pendientes:
+        return resumen
+
+    lotes = [pendientes[i:i + lote] for i in range(0, len(pendientes), lote)]
+    with ProcessPoolExecutor(max_workers=procesos) as grupo:
+        for resultado in grupo.map(_hashear_lote, lotes):
+            operaciones = [
+                UpdateOne({"_id": identificador, "contraseña": valor}, {"$set": {"contraseña": hashed}})
+                for identificador, valor, hashed in resultado
+            ]
+            escritura = db.usuarios.bulk_write(operaciones, ordered=False)
+            resumen["migradas"] += escritura.modified_count
+            resumen["cambiadas"] += len(operaciones) - escritura.matched_count
+            logging.info(f"Contraseñas migradas: {resumen['migradas']} de {len(pendientes)}")
+    return resumen
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Mantenimiento de credenciales de los usuarios.")
+    parser.add_argument("--migrar", action="store_true", help="rehashea las contraseñas guardadas en texto plano")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 2, help="procesos para calcular los hashes")
+    parser.add_argument("--simular", action="store_true", help="solo cuenta las contraseñas por migrar")
+    args = parser.parse_args()
+
+    if args.migrar:
+        from base_datos import db
+        resumen = migrar_contrasenas(db, procesos=args.procesos, simular=args.simular)
+        print(", ".join(f"{clave}: {valor}" for clave, valor in resumen.items()))
+        exit(0)
+    parser.print_help()
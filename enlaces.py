@@ -0,0 +1,39 @@
+import os
+import secrets
+from datetime import datetime, timezone
+
+# Dirección del bot; el enlace de entrega es URL_BOT?start=<token>
+URL_BOT = os.getenv("BOT_URL", "https://t.me/beeDICIS_bot")
+# Segundos que un enlace sigue siendo válido (índice TTL de db.enlaces)
+VIGENCIA = int(os.getenv("ENLACE_VIGENCIA", str(24 * 60 * 60)))
+
+# Entrega de resultados de la app al bot. Telegram limita el parámetro de /start a 64 caracteres
+# de [A-Za-z0-9_-], así que la app guarda la selección de temas en db.enlaces y abre el bot con
+# un token corto y opaco. La app genera el resultado mientras el usuario cambia a Telegram y lo
+# guarda en el mismo documento; el bot lo busca por el token.
+
+# Registra una selección de temas y devuelve su token (22 caracteres)
+def crear_enlace(db, tipo, temas):
+    token = secrets.token_urlsafe(16)
+    db.enlaces.insert_one({
+        "_id": token,
+        "tipo": tipo,
+        "temas": list(temas),
+        "resultado": None,
+        "creado": datetime.now(timezone.utc)
+    })
+    return token
+
+def url_enlace(token):
+    return f"{URL_BOT}?start={token}"
+
+def guardar_resultado(db, token, texto):
+    db.enlaces.update_one({"_id": token}, {"$set": {"resultado": texto, "terminado": datetime.now(timezone.utc)}})
+
+# La app no pudo generar el resultado; el bot deja de esperarlo y lo genera él
+def marcar_fallido(db, token):
+    db.enlaces.update_one({"_id": token}, {"$set": {"fallido": True, "terminado": datetime.now(timezone.utc)}})
+
+# Devuelve el enlace o None si no existe o ya expiró
+def leer_enlace(db, token):
+    return db.enlaces.find_one({"_id": token}, {"tipo": 1, "temas": 1, "resultado": 1, "fallido": 1})
@@ -0,0 +1,461 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from dotenv import load_dotenv
+
+from cache_preguntas import obtener_cache_preguntas
+from cache_resultados import clave_cache, obtener_cache
+from metricas import metricas
+from presupuesto import cerrar_en_oracion, contar_tokens, registro_uso
+
+# Carga las variables de entorno
+load_dotenv()
+
+MODELO = os.getenv("OPENAI_MODELO", "gpt-3.5-turbo")
+
+# Máximo de llamadas simultáneas a OpenAI en todo el proceso
+MAX_CONCURRENTES = int(os.getenv("OPENAI_MAX_CONCURRENTES", "8"))
+# Máximo de llamadas simultáneas por chat, para que un solo usuario no acapare los turnos
+MAX_POR_CHAT = int(os.getenv("OPENAI_MAX_POR_CHAT", "1"))
+# Tiempo máximo (segundos) de una generación, incluida la espera de turno
+TIEMPO_LIMITE = float(os.getenv("OPENAI_TIEMPO_LIMITE", "60"))
+
+# Chat cuyo turno ya tiene reservado la tarea actual (ver LimitadorConcurrencia.reservar_chat)
+_chat_reservado = contextvars.ContextVar("chat_reservado", default=None)
+
+# Limitador de concurrencia: un semáforo global y uno por chat.
+# Cada petición toma primero el turno de su chat y después un turno global,
+# así los chats compiten en orden de llegada y ninguno ocupa más de MAX_POR_CHAT turnos.
+class LimitadorConcurrencia:
+    def __init__(self, maximo=MAX_CONCURRENTES, por_chat=MAX_POR_CHAT):
+        self.maximo = maximo
+        self.por_chat = por_chat
+        self._global = asyncio.Semaphore(maximo)
+        self._chats = {}
+        self.en_curso = 0
+        self.en_espera = 0
+
+    def _tomar_entrada(self, chat_id):
+        entrada = self._chats.get(chat_id)
+        if entrada is None:
+            entrada = self._chats[chat_id] = [asyncio.Semaphore(self.por_chat), 0]
+        entrada[1] += 1
+        return entrada
+
+    # Se descarta el semáforo del chat cuando ya no tiene peticiones pendientes
+    def _soltar_entrada(self, chat_id, entrada):
+        entrada[1] -= 1
+        if entrada[1] <= 0:
+            self._chats.pop(chat_id, None)
+
+    @asynccontextmanager
+    async def turno(self, chat_id=None):
+        # Dentro de reservar_chat las solicitudes de ese chat solo esperan el turno global
+        if chat_id is not None and _chat_reservado.get() == chat_id:
+            chat_id = None
+        entrada = self._tomar_entrada(chat_id) if chat_id is not None else None
+        try:
+            async with self._esperar(entrada):
+                self.en_curso += 1
+                try:
+                    yield
+                finally:
+                    self.en_curso -= 1
+        finally:
+            if entrada is not None:
+                self._soltar_entrada(chat_id, entrada)
+
+    # Toma solo el turno del chat, para varias solicitudes de una misma petición (ver turno_de_peticion)
+    @asynccontextmanager
+    async def reservar_chat(self, chat_id):
+        entrada = self._tomar_entrada(chat_id)
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            self._soltar_entrada(chat_id, entrada)
+
+    @asynccontextmanager
+    async def _esperar(self, entrada):
+        self.en_espera += 1
+        try:
+            if entrada is not None:
+                await entrada[0].acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                if entrada is not None:
+                    entrada[0].release()
+                raise
+        finally:
+            self.en_espera -= 1
+        try:
+            yield
+        finally:
+            self._global.release()
+            if entrada is not None:
+                entrada[0].release()
+
+limitador = LimitadorConcurrencia()
+metricas.agregar_fuente("openai", lambda: {"en_curso": limitador.en_curso, "en_espera": limitador.en_espera})
+
+# Clave de una petición para compartir llamadas: mismo sistema, prompt normalizado y max_tokens
+def clave_vuelo(sistema, prompt, max_tokens):
+    return (MODELO, sistema, " ".join(prompt.lower().split()), max_tokens)
+
+# Texto producido por un flujo compartido; cada lector lo recorre desde el principio
+class _FlujoCompartido:
+    def __init__(self):
+        self.partes = []
+        self.terminado = False
+        self.error = None
+        self.lectores = 0
+        self.tarea = None
+        self._cambio = asyncio.Event()
+
+    def _avisar(self):
+        self._cambio.set()
+        self._cambio = asyncio.Event()
+
+    def agregar(self, parte):
+        self.partes.append(parte)
+        self._avisar()
+
+    def terminar(self, error=None):
+        self.terminado = True
+        self.error = error
+        self._avisar()
+
+    async def leer(self):
+        leidas = 0
+        while True:
+            while leidas < len(self.partes):
+                leidas += 1
+                yield self.partes[leidas - 1]
+            if self.terminado:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._cambio.wait()
+
+# Llamadas compartidas ("single-flight"): mientras una petición está en curso, las idénticas
+# esperan su resultado en lugar de llamar otra vez a la API. El trabajo corre en una tarea propia,
+# así que si un solicitante se cancela o agota su tiempo, los demás siguen recibiendo la respuesta.
+class VuelosCompartidos:
+    def __init__(self):
+        self._completados = {}
+        self._flujos = {}
+        self.compartidas = 0
+
+    async def completar(self, clave, fabrica):
+        tarea = self._completados.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(fabrica())
+            self._completados[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(self._completados, clave, t))
+        else:
+            self.compartidas += 1
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, en_curso, clave, tarea):
+        if en_curso.get(clave) is tarea:
+            del en_curso[clave]
+        # Se consulta la excepción para que asyncio no la reporte si nadie la esperó
+        if not tarea.cancelled():
+            tarea.exception()
+
+    # Cuando el último lector abandona un flujo sin terminar, se cancela la llamada a la API
+    async def flujo(self, clave, fabrica):
+        compartido = self._flujos.get(clave)
+        if compartido is None:
+            compartido = _FlujoCompartido()
+            self._flujos[clave] = compartido
+            compartido.tarea = asyncio.ensure_future(self._producir(clave, compartido, fabrica))
+        else:
+            self.compartidas += 1
+        compartido.lectores += 1
+        try:
+            async for parte in compartido.leer():
+                yield parte
+        finally:
+            compartido.lectores -= 1
+            if compartido.lectores == 0 and not compartido.terminado:
+                compartido.tarea.cancel()
+
+    async def _producir(self, clave, compartido, fabrica):
+        try:
+            async for parte in fabrica():
+                compartido.agregar(parte)
+            compartido.terminar()
+        except BaseException as e:
+            compartido.terminar(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            if self._flujos.get(clave) is compartido:
+                del self._flujos[clave]
+
+vuelos = VuelosCompartidos()
+metricas.agregar_fuente("vuelos", lambda: {"compartidas": vuelos.compartidas})
+
+_openai = None
+
+# Módulo openai ya configurado con la clave de API; se importa la primera vez que se necesita
+def obtener_openai():
+    global _openai
+    if _openai is None:
+        import openai
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        _openai = openai
+    return _openai
+
+# Texto de una respuesta completa; registra los tokens usados y, si la respuesta se cortó
+# por llegar a max_tokens, quita la oración incompleta del final
+def _texto_respuesta(respuesta, chat_id=None):
+    uso = respuesta.get("usage") or {}
+    registro_uso.registrar(uso.get("prompt_tokens", 0), uso.get("completion_tokens", 0), chat_id)
+    eleccion = respuesta["choices"][0]
+    texto = eleccion["message"]["content"].strip()
+    if eleccion.get("finish_reason") == "length":
+        texto = cerrar_en_oracion(texto)
+    return texto
+
+# Petición asíncrona a la API de OpenAI; devuelve el texto de la respuesta
+async def _pedir_completado(sistema, prompt, max_tokens, chat_id=None):
+    with metricas.medir("openai"):
+        respuesta = await obtener_openai().ChatCompletion.acreate(
+            model=MODELO,
+            messages=[
+                {"role": "system", "content": sistema},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            request_timeout=TIEMPO_LIMITE
+        )
+    return _texto_respuesta(respuesta, chat_id)
+
+# Petición bloqueante, para hilos en segundo plano (app de escritorio y trabajadores de la cola)
+def completar_sincrono(sistema, prompt, max_tokens=500):
+    with metricas.medir("openai"):
+        respuesta = obtener_openai().ChatCompletion.create(
+            model=MODELO,
+            messages=[
+                {"role": "system", "content": sistema},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            request_timeout=TIEMPO_LIMITE
+        )
+    return _texto_respuesta(respuesta)
+
+# Flujo bloqueante, para la vista previa de la app: produce los fragmentos según llegan del modelo.
+# Si se activa "cancelacion" (threading.Event) se deja de leer y se cierra el flujo de OpenAI.
+def completar_sincrono_en_flujo(sistema, prompt, max_tokens=500, cancelacion=None):
+    inicio = time.perf_counter()
+    partes = []
+    with metricas.medir("openai_flujo"):
+        flujo = obtener_openai().ChatCompletion.create(
+            model=MODELO,
+            messages=[
+                {"role": "system", "content": sistema},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            request_timeout=TIEMPO_LIMITE,
+            stream=True
+        )
+        try:
+            for fragmento in flujo:
+                if cancelacion is not None and cancelacion.is_set():
+                    break
+                contenido = fragmento["choices"][0].get("delta", {}).get("content")
+                if contenido:
+                    if not partes:
+                        metricas.observar("openai_primer_fragmento", time.perf_counter() - inicio)
+                    partes.append(contenido)
+                    yield contenido
+        finally:
+            if hasattr(flujo, "close"):
+                flujo.close()
+            # En flujo la API no informa el uso; se cuentan los tokens localmente
+            registro_uso.registrar(contar_tokens(sistema) + contar_tokens(prompt), contar_tokens("".join(partes)))
+
+async def _completar_con_turno(sistema, prompt, max_tokens, chat_id):
+    inicio = time.perf_counter()
+    async with limitador.turno(chat_id):
+        metricas.observar("openai_espera_turno", time.perf_counter() - inicio)
+        return await _pedir_completado(sistema, prompt, max_tokens, chat_id)
+
+async def _completar_directo(sistema, prompt, max_tokens, chat_id, tiempo_limite):
+    limite = tiempo_limite if tiempo_limite is not None else TIEMPO_LIMITE
+    try:
+        return await asyncio.wait_for(
+            _completar_con_turno(sistema, prompt, max_tokens, chat_id),
+            timeout=limite
+        )
+    except asyncio.TimeoutError:
+        logging.warning(f"La generación superó el tiempo límite de {limite}s (chat {chat_id})")
+        raise
+
+# Reserva el turno del chat para todas las solicitudes de una petición (los grupos de temas de un
+# resumen). Las solicitudes hechas dentro del bloque, también desde tareas creadas en él, solo
+# esperan el turno global: no se encolan entre sí y el tiempo límite de cada una no cuenta la
+# espera de las demás. La espera de la reserva tiene el tiempo límite de una generación.
+@asynccontextmanager
+async def turno_de_peticion(chat_id, tiempo_limite=None):
+    if chat_id is None or _chat_reservado.get() == chat_id:
+        yield
+        return
+    limite = tiempo_limite if tiempo_limite is not None else TIEMPO_LIMITE
+    inicio = time.perf_counter()
+    async with AsyncExitStack() as pila:
+        await asyncio.wait_for(pila.enter_async_context(limitador.reservar_chat(chat_id)), limite)
+        metricas.observar("openai_espera_turno", time.perf_counter() - inicio)
+        marca = _chat_reservado.set(chat_id)
+        try:
+            yield
+        finally:
+            _chat_reservado.reset(marca)
+
+# Genera un completado sin bloquear el bucle de eventos.
+# Las peticiones simultáneas con el mismo prompt normalizado comparten una sola llamada a la API.
+# Lanza asyncio.TimeoutError si la espera más la generación superan el tiempo límite.
+async def completar(sistema, prompt, max_tokens=500, chat_id=None, tiempo_limite=None):
+    return await vuelos.completar(
+        clave_vuelo(sistema, prompt, max_tokens),
+        lambda: _completar_directo(sistema, prompt, max_tokens, chat_id, tiempo_limite)
+    )
+
+# Busca una respuesta ya generada: caché en memoria y caché en MongoDB. Los fragmentos
+# precalculados (ver precomputo.py) no se consultan: son por materia y el bot solo recibe títulos.
+async def _buscar_guardado(cache, clave):
+    texto = cache.obtener_memoria(clave)
+    if texto is None:
+        texto = await asyncio.to_thread(cache.obtener, clave)
+    return texto
+
+# Genera un resumen o guía consultando antes la caché compartida.
+# Solo se guardan en caché las respuestas correctas de la API.
+async def completar_con_cache(tipo, temas, sistema, prompt, max_tokens=500, chat_id=None):
+    cache = obtener_cache()
+    clave = clave_cache(tipo, MODELO, temas, max_tokens)
+    texto = await _buscar_guardado(cache, clave)
+    if texto is not None:
+        return texto
+
+    texto = await completar(sistema, prompt, max_tokens=max_tokens, chat_id=chat_id)
+    await asyncio.to_thread(cache.guardar, clave, texto, tipo=tipo, modelo=MODELO)
+    return texto
+
+# Flujo directo contra la API: produce los fragmentos de texto según llegan del modelo.
+# El tiempo límite cubre la espera de turno y todo el flujo; al salir se cierra la conexión con OpenAI.
+async def _flujo_directo(sistema, prompt, max_tokens, chat_id, tiempo_limite):
+    limite = tiempo_limite if tiempo_limite is not None else TIEMPO_LIMITE
+    loop = asyncio.get_running_loop()
+    fin = loop.time() + limite
+    inicio = time.perf_counter()
+    async with AsyncExitStack() as pila:
+        await asyncio.wait_for(pila.enter_async_context(limitador.turno(chat_id)), fin - loop.time())
+        metricas.observar("openai_espera_turno", time.perf_counter() - inicio)
+        pila.enter_context(metricas.medir("openai_flujo"))
+        flujo = await asyncio.wait_for(
+            obtener_openai().ChatCompletion.acreate(
+                model=MODELO,
+                messages=[
+                    {"role": "system", "content": sistema},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                request_timeout=limite,
+                stream=True
+            ),
+            fin - loop.time()
+        )
+        if hasattr(flujo, "aclose"):
+            pila.push_async_callback(flujo.aclose)
+        # En flujo la API no informa el uso; se cuentan los tokens localmente al terminar
+        partes = []
+        pila.callback(lambda: registro_uso.registrar(
+            contar_tokens(sistema) + contar_tokens(prompt), contar_tokens("".join(partes)), chat_id
+        ))
+        iterador = flujo.__aiter__()
+        while True:
+            try:
+                fragmento = await asyncio.wait_for(iterador.__anext__(), fin - loop.time())
+            except StopAsyncIteration:
+                break
+            contenido = fragmento["choices"][0].get("delta", {}).get("content")
+            if contenido:
+                if not partes:
+                    metricas.observar("openai_primer_fragmento", time.perf_counter() - inicio)
+                partes.append(contenido)
+                yield contenido
+
+# Genera un completado en flujo. Si ya hay un flujo en curso con el mismo prompt normalizado,
+# se recibe ese mismo flujo (desde el principio) en lugar de abrir otro.
+async def completar_en_flujo(sistema, prompt, max_tokens=500, chat_id=None, tiempo_limite=None):
+    flujo = vuelos.flujo(
+        clave_vuelo(sistema, prompt, max_tokens),
+        lambda: _flujo_directo(sistema, prompt, max_tokens, chat_id, tiempo_limite)
+    )
+    async for fragmento in flujo:
+        yield fragmento
+
+# Versión en flujo de completar_con_cache: un acierto se entrega completo en un solo fragmento
+# y el texto generado se guarda en caché únicamente si el flujo terminó sin errores.
+async def completar_en_flujo_con_cache(tipo, temas, sistema, prompt, max_tokens=500, chat_id=None):
+    cache = obtener_cache()
+    clave = clave_cache(tipo, MODELO, temas, max_tokens)
+    texto = await _buscar_guardado(cache, clave)
+    if texto is not None:
+        yield texto
+        return
+
+    partes = []
+    async for fragmento in completar_en_flujo(sistema, prompt, max_tokens=max_tokens, chat_id=chat_id):
+        partes.append(fragmento)
+        yield fragmento
+    texto = "".join(partes).strip()
+    if texto:
+        await asyncio.to_thread(cache.guardar, clave, texto, tipo=tipo, modelo=MODELO)
+
+# Preguntas casi repetidas (ver cache_preguntas.py): la búsqueda es en memoria y, si hay acierto,
+# se renueva su vigencia en MongoDB sin esperar
+def _buscar_pregunta(cache, pregunta):
+    encontrada = cache.buscar(pregunta)
+    if encontrada is None:
+        return None
+    clave, respuesta = encontrada
+    asyncio.get_running_loop().run_in_executor(None, cache.renovar, clave)
+    return respuesta
+
+# Responde una pregunta reutilizando la respuesta de una pregunta casi igual, si la hay
+async def completar_pregunta(sistema, pregunta, max_tokens=500, chat_id=None):
+    cache = obtener_cache_preguntas()
+    respuesta = _buscar_pregunta(cache, pregunta)
+    if respuesta is not None:
+        return respuesta
+
+    respuesta = await completar(sistema, pregunta, max_tokens=max_tokens, chat_id=chat_id)
+    await asyncio.to_thread(cache.guardar, pregunta, respuesta)
+    return respuesta
+
+# Versión en flujo de completar_pregunta
+async def completar_en_flujo_pregunta(sistema, pregunta, max_tokens=500, chat_id=None):
+    cache = obtener_cache_preguntas()
+    respuesta = _buscar_pregunta(cache, pregunta)
+    if respuesta is not None:
+        yield respuesta
+        return
+
+    partes = []
+    async for fragmento in completar_en_flujo(sistema, pregunta, max_tokens=max_tokens, chat_id=chat_id):
+        partes.append(fragmento)
+        yield fragmento
+    respuesta = "".join(partes).strip()
+    if respuesta:
+        await asyncio.to_thread(cache.guardar, pregunta, respuesta)
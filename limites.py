@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from metricas import metricas
+from presupuesto import registro_uso
+
+# Peticiones seguidas que un chat puede hacer antes de que se aplique el ritmo sostenido
+RAFAGA = int(os.getenv("BOT_LIMITE_RAFAGA", "5"))
+# Peticiones por minuto que un chat puede sostener
+POR_MINUTO = float(os.getenv("BOT_LIMITE_POR_MINUTO", "6"))
+# Tokens de OpenAI (prompt + respuesta) por chat y día UTC; 0 = sin cuota
+CUOTA_DIARIA = int(os.getenv("BOT_CUOTA_DIARIA", "50000"))
+# Compartir los contadores entre instancias del bot en MongoDB (db.limites y db.uso_diario)
+COMPARTIDO = os.getenv("BOT_LIMITE_COMPARTIDO", "0") == "1"
+# Cubos en memoria antes de descartar los que ya se rellenaron
+MAX_CUBOS = 10000
+
+# Cubo de fichas: se rellena a ritmo constante hasta su capacidad y cada petición toma una ficha
+class CuboFichas:
+    __slots__ = ("capacidad", "por_segundo", "fichas", "actualizado")
+
+    def __init__(self, capacidad, por_segundo, ahora):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.fichas = capacidad
+        self.actualizado = ahora
+
+    def _rellenar(self, ahora):
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.actualizado) * self.por_segundo)
+        self.actualizado = ahora
+
+    # Toma una ficha; devuelve 0 si se pudo o los segundos que faltan para la siguiente
+    def tomar(self, ahora):
+        self._rellenar(ahora)
+        if self.fichas >= 1:
+            self.fichas -= 1
+            return 0.0
+        return (1 - self.fichas) / self.por_segundo
+
+    def lleno(self, ahora):
+        return self.fichas + (ahora - self.actualizado) * self.por_segundo >= self.capacidad
+
+def segundos_hasta_manana():
+    ahora = datetime.now(timezone.utc)
+    manana = datetime.combine(ahora.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    return (manana - ahora).total_seconds()
+
+# Límite de peticiones por chat para el bot.
+# La comprobación local (cubo de fichas y uso del día en presupuesto.registro_uso) no hace
+# operaciones de red, así que un chat que insiste recibe el rechazo al instante. Con compartido=True
+# se consultan además dos contadores en MongoDB, uno por minuto y otro por día, que suman las
+# peticiones y los tokens de todas las instancias. Si MongoDB falla la petición se permite.
+class Limitador:
+    def __init__(self, rafaga=RAFAGA, por_minuto=POR_MINUTO, cuota_diaria=CUOTA_DIARIA, compartido=COMPARTIDO,
+                 base=None, registro=registro_uso):
+        self.rafaga = rafaga
+        self.por_minuto = por_minuto
+        self.cuota_diaria = cuota_diaria
+        self.compartido = compartido
+        self._base = base
+        self.registro = registro
+        # Los cubos solo se usan desde el bucle de eventos
+        self._cubos = {}
+        # Tokens del día ya sumados al contador compartido, por chat
+        self._dia_enviado = None
+        self._enviado = {}
+        self._lock = threading.Lock()
+        self.contadores = {"permitidas": 0, "rechazos_rafaga": 0, "rechazos_cuota": 0, "errores_mongo": 0}
+
+    @property
+    def base(self):
+        if self._base is None:
+            from base_datos import db
+            self._base = db
+        return self._base
+
+    def _tomar_ficha(self, chat_id):
+        ahora = time.monotonic()
+        cubo = self._cubos.get(chat_id)
+        if cubo is None:
+            if len(self._cubos) >= MAX_CUBOS:
+                # Un cubo lleno equivale a uno nuevo, así que se puede descartar
+                for clave in [clave for clave, cubo in self._cubos.items() if cubo.lleno(ahora)]:
+                    del self._cubos[clave]
+            cubo = self._cubos[chat_id] = CuboFichas(self.rafaga, self.por_minuto / 60, ahora)
+        return cubo.tomar(ahora)
+
+    # Suma la petición y los tokens nuevos del chat a los contadores de MongoDB. Bloqueante:
+    # se llama con asyncio.to_thread. Devuelve (segundos de espera por ritmo, tokens usados hoy).
+    def _contar_compartido(self, chat_id):
+        from pymongo import ReturnDocument
+        ahora = datetime.now(timezone.utc)
+        minuto = int(ahora.timestamp() // 60)
+        ventana = self.base.limites.find_one_and_update(
+            {"_id": f"{chat_id}:{minuto}"},
+            {"$inc": {"peticiones": 1}, "$setOnInsert": {"expira": ahora + timedelta(minutes=2)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        espera = 60 - ahora.timestamp() % 60 if ventana["peticiones"] > self.por_minuto else 0.0
+
+        dia = ahora.date().isoformat()
+        local = self.registro.uso_del_dia(chat_id)
+        with self._lock:
+            if dia != self._dia_enviado:
+                self._dia_enviado, self._enviado = dia, {}
+            nuevos = local - self._enviado.get(chat_id, 0)
+            self._enviado[chat_id] = local
+        uso = self.base.uso_diario.find_one_and_update(
+            {"_id": f"{chat_id}:{dia}"},
+            {"$inc": {"tokens": nuevos}, "$setOnInsert": {"expira": ahora + timedelta(days=2)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return espera, uso["tokens"]
+
+    def _rechazar(self, motivo, segundos):
+        self.contadores[f"rechazos_{motivo}"] += 1
+        return motivo, max(1, math.ceil(segundos))
+
+    # Comprueba si el chat puede hacer otra petición. Devuelve None si puede, o (motivo, segundos)
+    # con motivo "rafaga" o "cuota" y los segundos que debe esperar.
+    async def comprobar(self, chat_id):
+        espera = self._tomar_ficha(chat_id)
+        if espera:
+            return self._rechazar("rafaga", espera)
+        usados = self.registro.uso_del_dia(chat_id)
+        if self.cuota_diaria and usados >= self.cuota_diaria:
+            return self._rechazar("cuota", segundos_hasta_manana())
+        if self.compartido:
+            try:
+                with metricas.medir("mongo_limites"):
+                    espera, usados = await asyncio.to_thread(self._contar_compartido, chat_id)
+            except Exception as e:
+                self.contadores["errores_mongo"] += 1
+                logging.warning(f"No se pudieron consultar los límites compartidos: {e}")
+                espera = 0
+            if espera:
+                return self._rechazar("rafaga", espera)
+            if self.cuota_diaria and usados >= self.cuota_diaria:
+                return self._rechazar("cuota", segundos_hasta_manana())
+        self.contadores["permitidas"] += 1
+        return None
+
+    def estadisticas(self):
+        return {**self.contadores, "chats": len(self._cubos)}
+
+limitador = Limitador()
+metricas.agregar_fuente("limites", limitador.estadisticas)
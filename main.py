@@ -1,5 +1,8 @@
-import os
-from pymongo import MongoClient
+import time
+
+# Marca de inicio para medir el arranque (importación y primer cuadro)
+_INICIO = time.perf_counter()
+
 from kivy.app import App
 from kivy.uix.screenmanager import Screen, ScreenManager
 from kivy.uix.boxlayout import BoxLayout
@@ -7,45 +10,70 @@ from kivy.uix.label import Label
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.button import Button
 from kivy.uix.checkbox import CheckBox
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.properties import BooleanProperty, NumericProperty, ObjectProperty, StringProperty
 from kivy.uix.textinput import TextInput
 from kivy.uix.popup import Popup
+from kivy.uix.progressbar import ProgressBar
+from kivy.clock import Clock
 from kivy.core.window import Window
 from dotenv import load_dotenv
-import openai
-from passlib.hash import pbkdf2_sha256  # Reemplazo de hashlib
+import math
+import os
+import re
+import threading
 import webbrowser
-from fpdf import FPDF  # Librería para generar PDFs
+from pathlib import Path
+# MongoDB, OpenAI, passlib y FPDF se cargan la primera vez que se usan, no al importar la app
+from base_datos import asegurar_indices, db
+from cache_resultados import clave_cache, obtener_cache
+from generacion import MODELO, completar_sincrono, completar_sincrono_en_flujo
+from precomputo import MIN_TEMAS_POR_PARTES, componer_desde_fragmentos, generar_por_partes, titulo_tema
+from metricas import metricas
+from pdfs import renderizador
+from presupuesto import contar_tokens, dividir_temas, max_tokens_para
+from tareas import ejecutor
+from catalogo import catalogo
+from cola import encolar, es_reintentable, esperar_resultado, hay_trabajador, parte_trabajo
+from enlaces import crear_enlace, guardar_resultado, marcar_fallido, url_enlace
+from credenciales import (
+    borrar_sesion_local, cerrar_sesion, crear_sesion, guardar_sesion_local, hash_password, leer_sesion_local,
+    validar_sesion, verify_password
+)
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Conexión segura a MongoDB Atlas
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["guia_app"]
-
-# Configura la clave de API de OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Mostrar los resúmenes y guías en el visor conforme se generan
+APP_EN_FLUJO = os.getenv("APP_EN_FLUJO", "1") == "1"
+# Segundos que la app espera un trabajo de la cola antes de mostrar el error
+ESPERA_COLA = float(os.getenv("APP_ESPERA_COLA", "120"))
+# Actualizaciones por segundo del visor durante una generación en flujo
+FPS_VISTA_PREVIA = float(os.getenv("APP_FPS_VISTA_PREVIA", "15"))
 
-# Función para hashear contraseñas
-def hash_password(password):
-    return pbkdf2_sha256.hash(password)
+# Instrucciones de sistema, prompt y título del PDF de cada generación de la app
+PROMPTS_APP = {
+    "resumen": (
+        "Eres un asistente que genera resúmenes educativos.",
+        "Genera un resumen detallado para los siguientes temas, sin agregar comentarios al final: {temas}"
+    ),
+    "guia": (
+        "Eres un asistente que genera guías de estudio educativas.",
+        "Genera una guía de estudio con preguntas clave para los siguientes temas, sin agregar comentarios adicionales: {temas}"
+    )
+}
+TITULOS_PDF = {"resumen": "Resumen", "guia": "Guía de Estudio"}
 
-# Verificar contraseña, con manejo mejorado de errores
-def verify_password(password, hashed):
-    try:
-        if pbkdf2_sha256.verify(password, hashed):
-            return True
-    except ValueError:
-        print("El formato del hash no es válido. Probablemente la contraseña no está hasheada.")
-    except Exception as e:
-        print(f"Error al verificar la contraseña: {e}")
-    return False
+_FIN_IMPORTACION = time.perf_counter()
 
 # Función para registrar un usuario
 def register_user(email, username, password):
+    from pymongo.errors import DuplicateKeyError
     if not email.endswith('@ugto.mx'):
         return "Debe usar un correo institucional que termine en @ugto.mx"
-    if db.usuarios.find_one({"correo": email}):
+    if db.usuarios.find_one({"correo": email}, {"_id": 1}):
         return "El correo ya está registrado"
     
     try:
@@ -55,26 +83,24 @@ def register_user(email, username, password):
             "contraseña": hash_password(password)
         })
         return "Registro exitoso"
+    except DuplicateKeyError:
+        # El índice único de correo cubre dos registros simultáneos con el mismo correo
+        return "El correo ya está registrado"
     except Exception as e:
         print(f"Error al registrar usuario: {e}")
         return "Hubo un problema al registrar. Intente nuevamente."
 
-# Función para iniciar sesión
+# Función para iniciar sesión. Las contraseñas en texto plano ya no se actualizan aquí una por una:
+# se migran todas de una vez con "python credenciales.py --migrar".
 def login_user(email, password):
     try:
-        user = db.usuarios.find_one({"correo": email})
+        with metricas.medir("mongo_login"):
+            user = db.usuarios.find_one({"correo": email}, {"contraseña": 1})
         if user:
             print("Usuario encontrado en la base de datos.")
-            hashed_password = user.get("contraseña")
-            if verify_password(password, hashed_password):
+            if verify_password(password, user.get("contraseña")):
                 print("Contraseña verificada correctamente.")
-                # Actualizar contraseña al nuevo formato si no estaba hasheada
-                if not pbkdf2_sha256.identify(hashed_password):
-                    print("Actualizando contraseña al nuevo formato.")
-                    db.usuarios.update_one(
-                        {"correo": email},
-                        {"$set": {"contraseña": hash_password(password)}}
-                    )
+                recordar_sesion(email)
                 return True
             else:
                 print("La contraseña ingresada es incorrecta.")
@@ -84,7 +110,32 @@ def login_user(email, password):
         print(f"Error al iniciar sesión: {e}")
     return False
 
-# Clase base para mostrar mensajes emergentes
+# Guarda en el equipo una sesión firmada para que la próxima vez no haga falta la contraseña
+def recordar_sesion(email):
+    try:
+        guardar_sesion_local(crear_sesion(db, email))
+    except Exception as e:
+        print(f"No se pudo guardar la sesión: {e}")
+
+# Entra con la sesión guardada: firma y vencimiento en local y una búsqueda por _id en MongoDB,
+# sin PBKDF2. Devuelve el correo o None si no hay sesión válida.
+def reanudar_sesion():
+    token = leer_sesion_local()
+    if token is None:
+        return None
+    with metricas.medir("mongo_sesion"):
+        correo = validar_sesion(db, token)
+    if correo is None:
+        borrar_sesion_local()
+    return correo
+
+def terminar_sesion():
+    token = leer_sesion_local()
+    borrar_sesion_local()
+    if token is not None:
+        cerrar_sesion(db, token)
+
+# Clase base para mostrar mensajes emergentes cortos; los textos generados se muestran en VisorResultado
 class PopupMessage:
     @staticmethod
     def show_message(title, message):
@@ -92,8 +143,7 @@ class PopupMessage:
 
         # Añadir un ScrollView para manejar mensajes largos
         scroll = ScrollView(size_hint=(1, 1))
-        formatted_message = "\n".join(message.split(", "))  # Dividir los elementos en líneas separadas
-        message_label = Label(text=formatted_message, size_hint_y=None, text_size=(400, None), valign='top', halign='left')
+        message_label = Label(text=message, size_hint_y=None, text_size=(400, None), valign='top', halign='left')
         message_label.bind(texture_size=message_label.setter('size'))
         scroll.add_widget(message_label)
 
@@ -106,56 +156,310 @@ class PopupMessage:
         close_button.bind(on_release=popup.dismiss)
         popup.open()
 
-# Función para generar resumen usando la API de OpenAI
-def generar_resumen(temas):
-    try:
-        prompt = f"Genera un resumen detallado para los siguientes temas, sin comentarios adicionales: {temas}"
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente que genera resúmenes educativos."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
-        )
-        return respuesta["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        print(f"Error al generar resumen: {e}")
-        return "Error al generar el resumen. Inténtalo más tarde."
+# Caracteres máximos de un bloque del visor; cada bloque es una textura pequeña
+BLOQUE_VISOR = 600
 
-# Función para generar guía de estudio usando la API de OpenAI
-def generar_guia(temas):
-    try:
-        prompt = f"Genera una guía de estudio con preguntas clave para los siguientes temas, sin comentarios adicionales: {temas}"
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente que genera guías de estudio educativas."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
-        )
-        return respuesta["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        print(f"Error al generar guía: {e}")
-        return "Error al generar la guía de estudio. Inténtalo más tarde."
+# Divide un texto generado en bloques de párrafos para el visor. Un párrafo largo se corta entre
+# líneas u oraciones y, si no tiene puntuación, en un espacio.
+def dividir_en_bloques(texto, max_caracteres=BLOQUE_VISOR):
+    bloques = []
+    for parrafo in re.split(r"\n\s*\n", texto.strip()):
+        parrafo = parrafo.strip()
+        if len(parrafo) <= max_caracteres:
+            if parrafo:
+                bloques.append(parrafo)
+            continue
+        actual = ""
+        for linea in parrafo.split("\n"):
+            for numero, oracion in enumerate(re.split(r"(?<=[.!?])\s+", linea.strip())):
+                while len(oracion) > max_caracteres:
+                    corte = oracion.rfind(" ", 0, max_caracteres)
+                    corte = corte if corte > 0 else max_caracteres
+                    if actual:
+                        bloques.append(actual)
+                        actual = ""
+                    bloques.append(oracion[:corte])
+                    oracion = oracion[corte:].lstrip()
+                if not oracion:
+                    continue
+                separador = " " if numero else "\n"
+                if actual and len(actual) + 1 + len(oracion) > max_caracteres:
+                    bloques.append(actual)
+                    actual = oracion
+                elif actual:
+                    actual = f"{actual}{separador}{oracion}"
+                else:
+                    actual = oracion
+        if actual:
+            bloques.append(actual)
+    return bloques
 
-# Función para manejar preguntas o peticiones adicionales usando la API de OpenAI
-def responder_pregunta(peticion):
-    try:
-        respuesta = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente educativo capaz de responder preguntas y realizar tareas según lo solicitado."},
-                {"role": "user", "content": peticion}
-            ],
-            max_tokens=500
+# Altura aproximada de un bloque antes de dibujarlo, para que la barra de desplazamiento sea estable;
+# con la fuente por defecto caben unos 7 px por carácter y 18 px por línea
+def estimar_alto(bloque, ancho):
+    por_linea = max(20, int(ancho / 7))
+    return 18 * sum(max(1, math.ceil(len(linea) / por_linea)) for linea in bloque.split("\n"))
+
+# Fila del visor de resultados. Al dibujarse mide su altura real y la guarda en los datos de la
+# lista, así la fila reciclada para otro bloque no vuelve a la estimación.
+class BloqueTexto(RecycleDataViewBehavior, Label):
+    def __init__(self, **kwargs):
+        super().__init__(size_hint_y=None, halign='left', valign='top', **kwargs)
+        self.lista = None
+        self.indice = 0
+        # El ancho se fija desde el inicio: sin él, un bloque se dibujaría en una sola línea enorme
+        self.text_size = (self.width, None)
+        self.bind(width=self._ajustar_ancho, texture_size=self._ajustar_alto)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.lista = rv
+        self.indice = index
+        super().refresh_view_attrs(rv, index, data)
+
+    def _ajustar_ancho(self, instance, ancho):
+        self.text_size = (ancho, None)
+
+    def _ajustar_alto(self, instance, tamano):
+        self.height = tamano[1]
+        if self.lista is not None and self.indice < len(self.lista.data):
+            self.lista.data[self.indice]['height'] = tamano[1]
+
+# Visor de resúmenes y guías: el texto se divide en bloques que una RecycleView dibuja solo cuando
+# están a la vista, así que un resumen largo cuesta lo mismo que uno corto. La ventana se crea una
+# vez y se reutiliza; permite copiar el texto y abrir su PDF.
+# En una generación en flujo los fragmentos llegan desde otro hilo a una lista pendiente y el reloj
+# de Kivy los pasa a la vista FPS_VISTA_PREVIA veces por segundo, no uno por fragmento.
+class VisorResultado:
+    _instancia = None
+
+    def __init__(self):
+        self.titulo = ""
+        self.texto = ""
+        self.tarea = None
+        self._sesion = 0
+        self._pendientes = []
+        self._lock = threading.Lock()
+        self._reloj = None
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+
+        self.lista = RecycleView(size_hint=(1, 1))
+        bloques_layout = RecycleBoxLayout(
+            orientation='vertical', size_hint_y=None, spacing=10, padding=[10, 10],
+            default_size=(None, 60), default_size_hint=(1, None)
         )
-        return respuesta["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        print(f"Error al responder la pregunta: {e}")
-        return "Error al procesar tu petición. Inténtalo más tarde."
-    
+        bloques_layout.bind(minimum_height=bloques_layout.setter('height'))
+        self.lista.add_widget(bloques_layout)
+        self.lista.viewclass = BloqueTexto
+        content.add_widget(self.lista)
+
+        self.estado_label = Label(text="", size_hint_y=None, height=30, shorten=True, shorten_from='left')
+        self.estado_label.bind(width=lambda instance, ancho: setattr(instance, 'text_size', (ancho, None)))
+        content.add_widget(self.estado_label)
+
+        botones_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height=50)
+        self.copiar_button = Button(text="Copiar", size_hint=(None, None), size=(200, 50), on_release=self.copiar)
+        self.exportar_button = Button(text="Abrir PDF", size_hint=(None, None), size=(200, 50), on_release=self.exportar)
+        self.cancel_button = Button(text="Cancelar", size_hint=(None, None), size=(200, 50), on_release=self.cancelar, disabled=True)
+        close_button = Button(text="Cerrar", size_hint=(None, None), size=(200, 50))
+        botones_layout.add_widget(self.copiar_button)
+        botones_layout.add_widget(self.exportar_button)
+        botones_layout.add_widget(self.cancel_button)
+        botones_layout.add_widget(close_button)
+        content.add_widget(botones_layout)
+
+        self.popup = Popup(title="", content=content, size_hint=(0.8, 0.8))
+        close_button.bind(on_release=self.popup.dismiss)
+        # Cerrar la ventana a media generación la cancela
+        self.popup.bind(on_dismiss=lambda instance: self.cancelar() if self._reloj is not None else None)
+
+    @classmethod
+    def obtener(cls):
+        if cls._instancia is None:
+            cls._instancia = cls()
+        return cls._instancia
+
+    @classmethod
+    def mostrar(cls, titulo, texto, archivo=None):
+        visor = cls.obtener()
+        if visor._reloj is not None:
+            visor.cancelar()
+        visor.titulo = titulo
+        visor.texto = texto
+        visor.popup.title = titulo
+        visor.estado_label.text = f"PDF guardado en {archivo}" if archivo else ""
+        visor.lista.data = []
+        visor._mostrar_bloques()
+        visor.lista.scroll_y = 1
+        visor.popup.open()
+
+    # Actualiza la lista con el texto actual. Solo se crean datos nuevos para los bloques que
+    # cambiaron (al generar en flujo, normalmente el último); los demás conservan su altura medida.
+    def _mostrar_bloques(self):
+        # Ancho de la ventana (80 %) menos márgenes
+        ancho = Window.width * 0.8 - 60
+        bloques = dividir_en_bloques(self.texto)
+        datos = self.lista.data
+        comunes = 0
+        while comunes < min(len(datos), len(bloques)) and datos[comunes]['text'] == bloques[comunes]:
+            comunes += 1
+        if comunes == len(datos) == len(bloques):
+            return
+        # Si el usuario está al final de la lista, la vista sigue al texto nuevo
+        seguir = self.lista.scroll_y <= 0.05 or len(datos) <= 1
+        self.lista.data = list(datos[:comunes]) + [
+            {'text': bloque, 'height': estimar_alto(bloque, ancho)} for bloque in bloques[comunes:]
+        ]
+        if seguir and self._reloj is not None:
+            self.lista.scroll_y = 0
+
+    def _en_flujo(self, activo):
+        self.cancel_button.disabled = not activo
+        self.copiar_button.disabled = activo
+        self.exportar_button.disabled = activo
+
+    # Abre el visor vacío para una generación en flujo. Devuelve la función que recibe los
+    # fragmentos; se puede llamar desde cualquier hilo y deja de aceptar texto al cancelar.
+    def iniciar_flujo(self, titulo):
+        if self._reloj is not None:
+            self.cancelar()
+        with self._lock:
+            self._sesion += 1
+            self._pendientes = []
+            sesion = self._sesion
+        self.titulo = titulo
+        self.texto = ""
+        self.tarea = None
+        self.popup.title = titulo
+        self.estado_label.text = "Generando..."
+        self.lista.data = []
+        self.lista.scroll_y = 1
+        self._en_flujo(True)
+        self._reloj = Clock.schedule_interval(self._volcar, 1 / FPS_VISTA_PREVIA)
+        self.popup.open()
+
+        def recibir(fragmento):
+            with self._lock:
+                if sesion == self._sesion:
+                    self._pendientes.append(fragmento)
+        return recibir
+
+    # Pasa a la vista los fragmentos recibidos desde el último cuadro
+    def _volcar(self, dt):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, []
+        if pendientes:
+            self.texto += "".join(pendientes)
+            self._mostrar_bloques()
+
+    def _detener_flujo(self):
+        with self._lock:
+            self._sesion += 1
+        if self._reloj is not None:
+            self._reloj.cancel()
+            self._reloj = None
+        self._en_flujo(False)
+
+    # Recibe (texto, archivo) al terminar: el texto final reemplaza al acumulado
+    def terminar_flujo(self, resultado):
+        self._volcar(0)
+        self._detener_flujo()
+        self.texto, archivo = resultado
+        self._mostrar_bloques()
+        self.estado_label.text = f"PDF guardado en {archivo}"
+
+    def fallar_flujo(self, error):
+        print(f"Error en la generación en flujo: {error}")
+        self._volcar(0)
+        self._detener_flujo()
+        self.estado_label.text = "Error al generar. Inténtelo de nuevo más tarde."
+
+    # Cancela la generación: el hilo deja de leer el flujo de OpenAI en el siguiente fragmento
+    def cancelar(self, instance=None):
+        if self.tarea is not None:
+            self.tarea.cancelar()
+            self.tarea = None
+        self._volcar(0)
+        self._detener_flujo()
+        self.estado_label.text = "Generación cancelada."
+
+    def copiar(self, instance):
+        from kivy.core.clipboard import Clipboard
+        Clipboard.copy(self.texto)
+        self.estado_label.text = "Texto copiado al portapapeles."
+
+    # El PDF sale de la caché de pdfs.py si ya se generó con el mismo texto
+    def exportar(self, instance):
+        self.estado_label.text = "Generando PDF..."
+        ejecutor.ejecutar(crear_pdf, self.titulo, self.texto, al_terminar=self._pdf_listo, al_fallar=self._pdf_fallido)
+
+    def _pdf_listo(self, archivo):
+        self.estado_label.text = f"PDF guardado en {archivo}"
+        webbrowser.open(Path(archivo).as_uri())
+
+    def _pdf_fallido(self, error):
+        print(f"Error al exportar el PDF: {error}")
+        self.estado_label.text = "No se pudo generar el PDF."
+
+# Ventana de progreso para las tareas en segundo plano, con botón para cancelarlas
+class PopupProgreso:
+    def __init__(self, title, message, al_cancelar=None):
+        self.tarea = None
+        self.al_cancelar = al_cancelar
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        content.add_widget(Label(text=message))
+        self.barra = ProgressBar(max=100, value=0, size_hint_y=None, height=30)
+        content.add_widget(self.barra)
+        cancel_button = Button(text="Cancelar", size_hint=(None, None), size=(200, 50))
+        cancel_button.bind(on_release=self.cancelar)
+        content.add_widget(cancel_button)
+        self.popup = Popup(title=title, content=content, size_hint=(0.6, 0.4), auto_dismiss=False)
+        # La barra avanza en ciclo mientras la tarea sigue en curso
+        self._animacion = Clock.schedule_interval(self._avanzar, 1 / 20)
+        self.popup.open()
+
+    def _avanzar(self, dt):
+        self.barra.value = (self.barra.value + 2) % 100
+
+    def cerrar(self):
+        self._animacion.cancel()
+        self.popup.dismiss()
+
+    # Al cancelar ya no se llaman al_terminar ni al_fallar, así que se llama al_cancelar
+    def cancelar(self, instance):
+        if self.tarea is not None:
+            self.tarea.cancelar()
+        self.cerrar()
+        if self.al_cancelar is not None:
+            self.al_cancelar()
+
+# Ejecuta una función bloqueante en segundo plano mostrando una ventana de progreso.
+# al_terminar y al_fallar se llaman en el hilo principal después de cerrar la ventana;
+# si el usuario cancela, se llama solo al_cancelar.
+def ejecutar_con_progreso(title, message, funcion, *args, al_terminar=None, al_fallar=None, al_cancelar=None, **kwargs):
+    progreso = PopupProgreso(title, message, al_cancelar)
+
+    def terminar(resultado):
+        progreso.cerrar()
+        if al_terminar is not None:
+            al_terminar(resultado)
+
+    def fallar(error):
+        progreso.cerrar()
+        print(f"Error en {title}: {error}")
+        if al_fallar is not None:
+            al_fallar(error)
+        else:
+            PopupMessage.show_message("Error", "Ocurrió un error inesperado. Inténtelo de nuevo.")
+
+    progreso.tarea = ejecutor.ejecutar(funcion, *args, al_terminar=terminar, al_fallar=fallar, **kwargs)
+    return progreso.tarea
+
+# Genera un PDF con un título y el texto separado en párrafos; devuelve la ruta del archivo.
+# Se dibuja en un proceso aparte y se guarda con el hash de su contenido (ver pdfs.py):
+# generaciones simultáneas no se pisan y un PDF idéntico no se vuelve a dibujar.
+def crear_pdf(titulo, texto):
+    return renderizador.renderizar(titulo, texto)
+
 class LoginScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -179,15 +483,44 @@ class LoginScreen(Screen):
 
         self.add_widget(self.layout)
 
+    # Con una sesión guardada se entra directo, sin verificar la contraseña. Se llama desde
+    # MainApp.primer_cuadro; el botón sigue activo mientras tanto, porque sin conexión la
+    # búsqueda en MongoDB puede tardar hasta que vence el tiempo de espera del cliente.
+    def reanudar(self):
+        ejecutor.ejecutar(reanudar_sesion, al_terminar=self._sesion_reanudada, al_fallar=self._sesion_no_reanudada)
+
+    def _sesion_reanudada(self, correo):
+        if correo is not None:
+            print(f"Sesión reanudada: {correo}")
+            # Si el usuario ya entró o se fue a registrarse, no se le cambia de pantalla
+            if self.manager.current == 'login':
+                self.manager.current = 'malla_curricular'
+
+    def _sesion_no_reanudada(self, error):
+        print(f"No se pudo reanudar la sesión: {error}")
+
     def iniciar_sesion(self, instance):
         email = self.email_input.text.strip()
         password = self.password_input.text.strip()
 
-        if login_user(email, password):
+        self.login_button.disabled = True
+        ejecutar_con_progreso(
+            "Iniciar Sesión", "Verificando credenciales...", login_user, email, password,
+            al_terminar=self._sesion_verificada, al_fallar=self._sesion_fallida,
+            al_cancelar=lambda: setattr(self.login_button, 'disabled', False)
+        )
+
+    def _sesion_verificada(self, correcto):
+        self.login_button.disabled = False
+        if correcto:
             self.manager.current = 'malla_curricular'
         else:
             PopupMessage.show_message("Error", "Correo o contraseña incorrectos")
 
+    def _sesion_fallida(self, error):
+        self.login_button.disabled = False
+        PopupMessage.show_message("Error", "No se pudo iniciar sesión. Inténtelo de nuevo.")
+
     def ir_a_registro(self, instance):
         self.manager.current = 'register'
 
@@ -219,45 +552,72 @@ class RegisterScreen(Screen):
         username = self.username_input.text.strip()
         password = self.password_input.text.strip()
 
-        resultado = register_user(email, username, password)
+        self.register_button.disabled = True
+        ejecutar_con_progreso(
+            "Registro", "Registrando usuario...", register_user, email, username, password,
+            al_terminar=self._registro_terminado, al_fallar=self._registro_fallido,
+            al_cancelar=lambda: setattr(self.register_button, 'disabled', False)
+        )
+
+    def _registro_terminado(self, resultado):
+        self.register_button.disabled = False
         PopupMessage.show_message("Registro", resultado)
         if resultado == "Registro exitoso":
             self.manager.current = 'login'
+
+    def _registro_fallido(self, error):
+        self.register_button.disabled = False
+        PopupMessage.show_message("Registro", "Hubo un problema al registrar. Intente nuevamente.")
             
+# Fila de la lista de temas; la RecycleView reutiliza unas pocas filas para todos los temas
+class FilaTema(RecycleDataViewBehavior, BoxLayout):
+    texto = StringProperty("")
+    activo = BooleanProperty(False)
+    indice = NumericProperty(0)
+    pantalla = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='horizontal', size_hint_y=None, height=50, **kwargs)
+        self.checkbox = CheckBox(size_hint=(None, None), size=(50, 50))
+        self.checkbox.bind(on_release=self.cambiar_seleccion)
+        self.label = Label()
+        self.add_widget(self.checkbox)
+        self.add_widget(self.label)
+
+    def refresh_view_attrs(self, rv, index, data):
+        super().refresh_view_attrs(rv, index, data)
+        self.label.text = self.texto
+        self.checkbox.active = self.activo
+
+    def cambiar_seleccion(self, instance):
+        if self.pantalla is not None:
+            self.pantalla.marcar_tema(self.indice, instance.active)
+
 class TemarioScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical', spacing=20, padding=[20, 20, 20, 20])
-        self.temas_checkbox = []
-        self.add_widget(self.layout)
+        self.materia = None
+        # Datos de la lista por materia (se construyen una sola vez) y temas seleccionados por materia
+        self._datos_por_materia = {}
+        self.seleccion = {}
+        self._tarea_temas = None
 
-    def cargar_temas(self, materia):
-        self.layout.clear_widgets()
-        self.layout.add_widget(Label(text=f"Temario de {materia}", font_size='24sp', size_hint_y=None, height=50))
+        self.titulo_label = Label(text="Temario", font_size='24sp', size_hint_y=None, height=50)
+        self.layout.add_widget(self.titulo_label)
+        self.estado_label = Label(text="", size_hint=(1, None), height=0)
+        self.layout.add_widget(self.estado_label)
 
-        scroll = ScrollView(size_hint=(1, 1))
-        temas_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=10, padding=[10, 10])
+        self.lista_temas = RecycleView(size_hint=(1, 1))
+        temas_layout = RecycleBoxLayout(
+            orientation='vertical', size_hint_y=None, spacing=10, padding=[10, 10],
+            default_size=(None, 50), default_size_hint=(1, None)
+        )
         temas_layout.bind(minimum_height=temas_layout.setter('height'))
-
-        try:
-            temas = db.materias.find_one({"nombre": materia})
-            if temas and "temas" in temas:
-                for tema in temas["temas"]:
-                    tema_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=50)
-                    checkbox = CheckBox(size_hint=(None, None), size=(50, 50))
-                    tema_label = Label(text=f"{tema.get('numero', '')}. {tema.get('titulo', 'Título desconocido')}")
-                    tema_layout.add_widget(checkbox)
-                    tema_layout.add_widget(tema_label)
-                    self.temas_checkbox.append((checkbox, tema_label.text))
-                    temas_layout.add_widget(tema_layout)
-            else:
-                temas_layout.add_widget(Label(text="No hay temas disponibles", size_hint=(1, None), height=40))
-        except Exception as e:
-            print(f"Error al cargar temas: {e}")
-            temas_layout.add_widget(Label(text="Error al cargar temas", size_hint=(1, None), height=40))
-
-        scroll.add_widget(temas_layout)
-        self.layout.add_widget(scroll)
+        self.lista_temas.add_widget(temas_layout)
+        # La clase de las filas pertenece al layout: se asigna después de agregarlo
+        self.lista_temas.viewclass = FilaTema
+        self.layout.add_widget(self.lista_temas)
 
         # Añadir botones para generar resumen y guía de estudio
         botones_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height=50)
@@ -273,101 +633,294 @@ class TemarioScreen(Screen):
         botones_layout.add_widget(telegram_button)
         self.layout.add_widget(botones_layout)
 
+        self.add_widget(self.layout)
+
+    def cargar_temas(self, materia):
+        self.materia = materia
+        self.titulo_label.text = f"Temario de {materia}"
+        if self._tarea_temas is not None:
+            self._tarea_temas.cancelar()
+            self._tarea_temas = None
+
+        # Volver a una materia ya visitada solo cambia los datos de la lista
+        if materia in self._datos_por_materia:
+            self.mostrar_datos(materia)
+            return
+
+        temas = catalogo.temas(materia)
+        if temas is not None:
+            # La materia está en la copia local del catálogo: no hace falta ir a MongoDB
+            self.mostrar_temas(materia, {"temas": temas})
+        else:
+            # La consulta a MongoDB se hace en segundo plano; si se cambia de materia antes de que
+            # termine, la consulta anterior se cancela para que no pinte temas de otra materia
+            self.lista_temas.data = []
+            self.mostrar_estado("Cargando temas...")
+            self._tarea_temas = ejecutor.ejecutar(
+                self.consultar_temas, materia,
+                al_terminar=lambda temas: self.mostrar_temas(materia, temas),
+                al_fallar=lambda error: self.mostrar_error_temas(materia, error)
+            )
+
+    # Con una versión nueva del catálogo los temas guardados por materia pueden haber cambiado, y
+    # la selección guarda índices de esa lista, así que se descartan ambos
+    def olvidar_temas(self):
+        self._datos_por_materia.clear()
+        self.seleccion.clear()
+        if self.materia is not None and self.manager is not None and self.manager.current == self.name:
+            self.cargar_temas(self.materia)
+
+    def consultar_temas(self, materia):
+        with metricas.medir("mongo_temas"):
+            return db.materias.find_one({"nombre": materia}, {"_id": 0, "temas.numero": 1, "temas.titulo": 1})
+
+    def mostrar_estado(self, texto):
+        self.estado_label.text = texto
+        self.estado_label.height = 40 if texto else 0
+
+    def mostrar_temas(self, materia, temas):
+        if temas and "temas" in temas:
+            self._datos_por_materia[materia] = [
+                {"texto": titulo_tema(tema), "indice": indice, "activo": False, "pantalla": self}
+                for indice, tema in enumerate(temas["temas"])
+            ]
+            self.seleccion.setdefault(materia, set())
+            if materia == self.materia:
+                self.mostrar_datos(materia)
+        elif materia == self.materia:
+            self.lista_temas.data = []
+            self.mostrar_estado("No hay temas disponibles")
+
+    def mostrar_datos(self, materia):
+        datos = self._datos_por_materia[materia]
+        self.lista_temas.data = datos
+        self.mostrar_estado("" if datos else "No hay temas disponibles")
+
+    def mostrar_error_temas(self, materia, error):
+        print(f"Error al cargar temas: {error}")
+        if materia == self.materia:
+            self.lista_temas.data = []
+            self.mostrar_estado("Error al cargar temas")
+
+    def marcar_tema(self, indice, activo):
+        datos = self._datos_por_materia.get(self.materia)
+        if datos is None:
+            return
+        datos[indice]["activo"] = activo
+        if activo:
+            self.seleccion[self.materia].add(indice)
+        else:
+            self.seleccion[self.materia].discard(indice)
+
+    # Temas seleccionados de la materia actual, en el orden del temario
+    def temas_seleccionados(self):
+        datos = self._datos_por_materia.get(self.materia, [])
+        return [datos[indice]["texto"] for indice in sorted(self.seleccion.get(self.materia, ()))]
+
     def generar_resumen(self, instance):
-        seleccionados = [tema[1] for tema in self.temas_checkbox if tema[0].active]
+        seleccionados = self.temas_seleccionados()
         if not seleccionados:
             PopupMessage.show_message("Error", "Seleccione al menos un tema para generar el resumen.")
             return
 
-        resumen = self.obtener_resumen_openai(seleccionados)
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", 'B', size=16)
-        pdf.cell(0, 10, txt="Resumen", ln=True, align='C')
-        pdf.ln(10)  # Espaciado
+        if APP_EN_FLUJO:
+            self.generar_en_flujo("resumen", seleccionados)
+            return
 
-        pdf.set_font("Arial", size=12)
-        for tema in resumen.split('\n\n'):
-            pdf.multi_cell(0, 10, txt=tema)
-            pdf.ln(5)  # Espacio entre párrafos
+        # La llamada a OpenAI y el PDF se generan fuera del hilo principal
+        ejecutar_con_progreso(
+            "Resumen", "Generando resumen...", self.crear_resumen_pdf, seleccionados,
+            al_terminar=lambda resultado: VisorResultado.mostrar("Resumen", *resultado)
+        )
 
-        pdf.output("resumen.pdf")
-        PopupMessage.show_message("Éxito", "Resumen generado y guardado como resumen.pdf.")
+    # Devuelve el texto y la ruta del PDF
+    def crear_resumen_pdf(self, seleccionados):
+        resumen = self.obtener_resumen_openai(seleccionados)
+        return resumen, crear_pdf("Resumen", resumen)
 
     def generar_guia(self, instance):
-        seleccionados = [tema[1] for tema in self.temas_checkbox if tema[0].active]
+        seleccionados = self.temas_seleccionados()
         if not seleccionados:
             PopupMessage.show_message("Error", "Seleccione al menos un tema para generar la guía de estudio.")
             return
 
+        if APP_EN_FLUJO:
+            self.generar_en_flujo("guia", seleccionados)
+            return
+
+        ejecutar_con_progreso(
+            "Guía de Estudio", "Generando guía de estudio...", self.crear_guia_pdf, seleccionados,
+            al_terminar=lambda resultado: VisorResultado.mostrar("Guía de Estudio", *resultado)
+        )
+
+    def crear_guia_pdf(self, seleccionados):
         guia = self.obtener_guia_openai(seleccionados)
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", 'B', size=16)
-        pdf.cell(0, 10, txt="Guía de Estudio", ln=True, align='C')
-        pdf.ln(10)  # Espaciado
+        return guia, crear_pdf("Guía de Estudio", guia)
 
-        pdf.set_font("Arial", size=12)
-        for tema in guia.split('\n\n'):
-            pdf.multi_cell(0, 10, txt=tema)
-            pdf.ln(5)  # Espacio entre preguntas
+    # Muestra el texto en el visor conforme llega del modelo; el PDF se escribe al final con el
+    # texto acumulado. Cancelar en el visor detiene el flujo de OpenAI.
+    def generar_en_flujo(self, tipo, seleccionados):
+        visor = VisorResultado.obtener()
+        recibir = visor.iniciar_flujo(TITULOS_PDF[tipo])
+        visor.tarea = ejecutor.ejecutar(
+            self.crear_en_flujo, tipo, seleccionados, recibir,
+            al_terminar=visor.terminar_flujo, al_fallar=visor.fallar_flujo, pasar_cancelacion=True
+        )
 
-        pdf.output("guia_estudio.pdf")
-        PopupMessage.show_message("Éxito", "Guía de estudio generada y guardada como guia_estudio.pdf.")
+    # Devuelve el texto y la ruta del PDF; si se canceló no se escribe el PDF
+    def crear_en_flujo(self, tipo, seleccionados, recibir, cancelacion):
+        texto = self.obtener_en_flujo(tipo, seleccionados, recibir, cancelacion)
+        if cancelacion.is_set():
+            return None
+        return texto, crear_pdf(TITULOS_PDF[tipo], texto)
 
     def enviar_resumen_al_bot(self, instance):
-        seleccionados = [tema[1] for tema in self.temas_checkbox if tema[0].active]
+        seleccionados = self.temas_seleccionados()
         if not seleccionados:
             PopupMessage.show_message("Error", "Seleccione al menos un tema para enviar el resumen al bot.")
             return
 
-        temas = ', '.join(seleccionados)
-        webbrowser.open(f"https://t.me/beeDICIS_bot?start=resumen_{temas}")
+        ejecutor.ejecutar(self.preparar_enlace, "resumen", seleccionados, al_terminar=webbrowser.open, al_fallar=self.mostrar_error_enlace)
 
     def enviar_guia_al_bot(self, instance):
-        seleccionados = [tema[1] for tema in self.temas_checkbox if tema[0].active]
+        seleccionados = self.temas_seleccionados()
         if not seleccionados:
             PopupMessage.show_message("Error", "Seleccione al menos un tema para enviar la guía al bot.")
             return
 
-        temas = ', '.join(seleccionados)
-        webbrowser.open(f"https://t.me/beeDICIS_bot?start=guia_{temas}")
+        ejecutor.ejecutar(self.preparar_enlace, "guia", seleccionados, al_terminar=webbrowser.open, al_fallar=self.mostrar_error_enlace)
+
+    # Registra la selección en db.enlaces (ver enlaces.py) y empieza a generar el resultado en
+    # segundo plano; el bot se abre con un token corto y encuentra la respuesta ya lista
+    def preparar_enlace(self, tipo, seleccionados):
+        token = crear_enlace(db, tipo, seleccionados)
+        ejecutor.ejecutar(self.completar_enlace, token, tipo, seleccionados)
+        return url_enlace(token)
+
+    # Solo se guarda un resultado correcto; si falla, el enlace queda marcado y el bot lo genera
+    def completar_enlace(self, token, tipo, seleccionados):
+        try:
+            texto = self.generar_texto(tipo, seleccionados)
+        except Exception as e:
+            print(f"Error al generar el resultado del enlace: {e}")
+            marcar_fallido(db, token)
+            return
+        guardar_resultado(db, token, texto)
+
+    def mostrar_error_enlace(self, error):
+        print(f"Error al preparar el enlace al bot: {error}")
+        PopupMessage.show_message("Error", "No se pudo enviar la selección al bot. Inténtelo de nuevo más tarde.")
 
     def ir_a_telegram(self, instance):
         webbrowser.open("https://t.me/beeDICIS_bot")
         
     def obtener_resumen_openai(self, temas):
         try:
-            prompt = f"Genera un resumen detallado para los siguientes temas, sin agregar comentarios al final: {', '.join(temas)}"
-            respuesta = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Eres un asistente que genera resúmenes educativos."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000
-            )
-            return respuesta["choices"][0]["message"]["content"].strip()
+            return self.generar_texto("resumen", temas)
         except Exception as e:
             print(f"Error al generar resumen con OpenAI: {e}")
             return "Error al generar el resumen. Inténtelo de nuevo más tarde."
 
     def obtener_guia_openai(self, temas):
         try:
-            prompt = f"Genera una guía de estudio con preguntas clave para los siguientes temas, sin agregar comentarios adicionales: {', '.join(temas)}"
-            respuesta = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Eres un asistente que genera guías de estudio educativas."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000
-            )
-            return respuesta["choices"][0]["message"]["content"].strip()
+            return self.generar_texto("guia", temas)
         except Exception as e:
             print(f"Error al generar guía con OpenAI: {e}")
             return "Error al generar la guía de estudio. Inténtelo de nuevo más tarde."
 
+    # Genera el resumen o la guía; a diferencia de obtener_resumen_openai / obtener_guia_openai,
+    # un error se lanza
+    def generar_texto(self, tipo, temas):
+        # Los textos ya generados para el mismo conjunto de temas salen de la caché
+        cache = obtener_cache()
+        max_tokens = max_tokens_para(tipo, len(temas))
+        clave = clave_cache(tipo, MODELO, temas, max_tokens)
+        texto = cache.obtener(clave)
+        if texto is None:
+            # Si todos los temas están precalculados, el texto se arma sin llamar a la API
+            texto = componer_desde_fragmentos(db, tipo, temas, self.materia)
+        if texto is not None:
+            return texto
+
+        sistema, plantilla = PROMPTS_APP[tipo]
+        prompt = plantilla.format(temas=", ".join(temas))
+        try:
+            # Con muchos temas se genera por partes en paralelo (ver precomputo.generar_por_partes)
+            if len(temas) >= MIN_TEMAS_POR_PARTES:
+                texto = generar_por_partes(db, tipo, temas, self.materia)
+            else:
+                texto = completar_sincrono(sistema, prompt, max_tokens)
+        except Exception as e:
+            if not es_reintentable(e):
+                raise
+            texto = self.esperar_en_cola(tipo, temas, e)
+        cache.guardar(clave, texto, tipo=tipo, modelo=MODELO)
+        return texto
+
+    # Versión en flujo de obtener_resumen_openai / obtener_guia_openai: entrega el texto a "recibir"
+    # por fragmentos. Lo ya guardado (caché o fragmentos precalculados) llega en un solo fragmento;
+    # las selecciones grandes se generan por partes en paralelo y cada parte llega en flujo, en orden.
+    def obtener_en_flujo(self, tipo, temas, recibir, cancelacion):
+        cache = obtener_cache()
+        max_tokens = max_tokens_para(tipo, len(temas))
+        clave = clave_cache(tipo, MODELO, temas, max_tokens)
+        texto = cache.obtener(clave)
+        if texto is None:
+            texto = componer_desde_fragmentos(db, tipo, temas, self.materia)
+        if texto is not None:
+            recibir(texto)
+            return texto
+
+        sistema, plantilla = PROMPTS_APP[tipo]
+        prompt = plantilla.format(temas=", ".join(temas))
+        partes = []
+
+        def recibir_parte(fragmento):
+            partes.append(fragmento)
+            recibir(fragmento)
+
+        try:
+            if len(temas) >= MIN_TEMAS_POR_PARTES:
+                generar_por_partes(db, tipo, temas, self.materia, al_avanzar=recibir_parte, cancelacion=cancelacion)
+            else:
+                for fragmento in completar_sincrono_en_flujo(sistema, prompt, max_tokens, cancelacion):
+                    recibir_parte(fragmento)
+        except Exception as e:
+            # Un flujo que ya mostró texto no se repite desde la cola
+            if partes or not es_reintentable(e):
+                raise
+            texto = self.esperar_en_cola(tipo, temas, e, cancelacion)
+            if texto is None:
+                return ""
+            recibir(texto)
+            cache.guardar(clave, texto, tipo=tipo, modelo=MODELO)
+            return texto
+        texto = "".join(partes).strip()
+        if texto and not cancelacion.is_set():
+            cache.guardar(clave, texto, tipo=tipo, modelo=MODELO)
+        return texto
+
+    # Ante límites de uso o fallas pasajeras de OpenAI la generación pasa a la cola de trabajos
+    # (ver cola.py) y este hilo espera el resultado; el trabajador lo guarda también en la caché.
+    # Si se activa "cancelacion" se deja de esperar y se devuelve None; el trabajo sigue en la cola.
+    # Sin trabajadores vivos (ver cola.hay_trabajador) no se encola y se lanza el error original,
+    # y la espera se corta a los ESPERA_COLA segundos, para que el usuario vea el error y no una
+    # ventana de progreso sin fin.
+    # Los temas se reparten en grupos como en el bot (ver presupuesto.dividir_temas), una parte del
+    # trabajo por grupo, para que una selección grande no quede en una sola respuesta recortada.
+    def esperar_en_cola(self, tipo, temas, error, cancelacion=None):
+        if not hay_trabajador(db):
+            raise error
+        print(f"OpenAI no disponible por ahora; {tipo} en cola")
+        sistema, plantilla = PROMPTS_APP[tipo]
+        partes = []
+        for grupo in dividir_temas(tipo, temas):
+            prompt = plantilla.format(temas=", ".join(grupo))
+            tokens_prompt = contar_tokens(sistema) + contar_tokens(prompt)
+            partes.append(parte_trabajo(sistema, prompt, max_tokens_para(tipo, len(grupo), tokens_prompt), grupo))
+        trabajo_id = encolar(db, tipo, partes, {"canal": "app"})
+        return esperar_resultado(db, trabajo_id, tiempo_limite=ESPERA_COLA, cancelacion=cancelacion)
+
     def salir(self, instance):
         self.manager.current = 'malla_curricular'
         
@@ -381,47 +934,102 @@ class MallaCurricularScreen(Screen):
         materias_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=10, padding=[10, 10])
         materias_layout.bind(minimum_height=materias_layout.setter('height'))
 
-        try:
-            semestres = db.materias.aggregate([
-                {"$group": {"_id": "$semestre", "materias": {"$push": "$nombre"}}},
-                {"$sort": {"_id": 1}}
-            ])
-
-            for semestre in semestres:
-                semestre_id = semestre["_id"] if semestre["_id"] else "Sin nombre"
-                materias_layout.add_widget(Label(text=str(semestre_id), font_size='20sp', size_hint_y=None, height=40))
-                for materia in semestre["materias"]:
-                    materia_nombre = materia if materia else "Materia desconocida"
-                    materias_layout.add_widget(
-                        Button(text=str(materia_nombre), size_hint_y=None, height=50, on_release=self.seleccionar_materia)
-                    )
-
-        except Exception as e:
-            print(f"Error al cargar materias: {e}")
-            materias_layout.add_widget(Label(text="Error al cargar materias", size_hint_y=None, height=40))
+        # La malla se muestra de inmediato desde la copia local del catálogo y en segundo plano
+        # se descarga de nuevo solo si cambió la versión publicada en MongoDB
+        self.materias_layout = materias_layout
+        if catalogo.cargar():
+            self.mostrar_semestres(catalogo.semestres())
+        else:
+            materias_layout.add_widget(Label(text="Cargando materias...", size_hint_y=None, height=40))
+        ejecutor.ejecutar(catalogo.actualizar_si_cambio, db, al_terminar=self.catalogo_actualizado, al_fallar=self.mostrar_error_materias)
 
         scroll.add_widget(materias_layout)
         layout.add_widget(scroll)
         layout.add_widget(Button(text="Salir", size_hint=(None, None), size=(200, 50), on_release=self.salir))
         self.add_widget(layout)
 
+    def catalogo_actualizado(self, cambio):
+        if cambio:
+            self.mostrar_semestres(catalogo.semestres())
+            # La pantalla del temario se construye al abrirla; si aún no existe no hay nada que olvidar
+            if self.manager is not None and self.manager.has_screen('temario'):
+                self.manager.get_screen('temario').olvidar_temas()
+
+    def mostrar_semestres(self, semestres):
+        self.materias_layout.clear_widgets()
+        for semestre, materias in semestres:
+            semestre_id = semestre if semestre else "Sin nombre"
+            self.materias_layout.add_widget(Label(text=str(semestre_id), font_size='20sp', size_hint_y=None, height=40))
+            for materia in materias:
+                materia_nombre = materia if materia else "Materia desconocida"
+                self.materias_layout.add_widget(
+                    Button(text=str(materia_nombre), size_hint_y=None, height=50, on_release=self.seleccionar_materia)
+                )
+
+    def mostrar_error_materias(self, error):
+        print(f"Error al cargar materias: {error}")
+        if catalogo.disponible:
+            # Sin conexión se sigue trabajando con la copia local
+            return
+        self.materias_layout.clear_widgets()
+        self.materias_layout.add_widget(Label(text="Error al cargar materias", size_hint_y=None, height=40))
+
     def seleccionar_materia(self, instance):
         print(f"Materia seleccionada: {instance.text}")
         self.manager.current = 'temario'
         self.manager.get_screen('temario').cargar_temas(instance.text)
 
     def salir(self, instance):
+        ejecutor.ejecutar(terminar_sesion)
         self.manager.current = 'login'
 
 
+# ScreenManager que construye cada pantalla la primera vez que se muestra o se pide
+class GestorPantallas(ScreenManager):
+    def __init__(self, fabricas, **kwargs):
+        self.fabricas = fabricas
+        super().__init__(**kwargs)
+
+    def _asegurar_pantalla(self, name):
+        if name in self.fabricas and not self.has_screen(name):
+            self.add_widget(self.fabricas[name](name=name))
+
+    def get_screen(self, name):
+        self._asegurar_pantalla(name)
+        return super().get_screen(name)
+
+    def on_current(self, instance, value):
+        self._asegurar_pantalla(value)
+        super().on_current(instance, value)
+
 class MainApp(App):
     def build(self):
-        sm = ScreenManager()
-        sm.add_widget(LoginScreen(name='login'))
-        sm.add_widget(RegisterScreen(name='register'))
-        sm.add_widget(MallaCurricularScreen(name='malla_curricular'))
-        sm.add_widget(TemarioScreen(name='temario'))
+        sm = GestorPantallas({
+            'login': LoginScreen,
+            'register': RegisterScreen,
+            'malla_curricular': MallaCurricularScreen,
+            'temario': TemarioScreen
+        })
+        sm.current = 'login'
         return sm
 
+    def on_start(self):
+        # El primer cuadro se dibuja después de on_start; se mide en el siguiente ciclo del reloj
+        Clock.schedule_once(self.primer_cuadro, 0)
+
+    def primer_cuadro(self, dt):
+        ahora = time.perf_counter()
+        print(f"Arranque: importación {_FIN_IMPORTACION - _INICIO:.3f} s, primer cuadro {ahora - _INICIO:.3f} s")
+        # La sesión guardada y los índices se revisan en segundo plano y hasta que el login ya
+        # está en pantalla
+        self.root.get_screen('login').reanudar()
+        ejecutor.ejecutar(asegurar_indices)
+
+    def on_stop(self):
+        ejecutor.cerrar()
+        renderizador.cerrar()
+        # Tiempos por etapa de la sesión (MongoDB, OpenAI, PDF) y aciertos de caché
+        print(f"Métricas de la sesión:\n{metricas.resumen()}")
+
 if __name__ == '__main__':
     MainApp().run()
@@ -0,0 +1,131 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites (segundos) de los intervalos de los histogramas, de 5 ms a 2 minutos
+LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Histograma acumulativo al estilo de Prometheus: cuenta por intervalo, suma y total.
+# Registrar una observación es una búsqueda binaria y una suma bajo un lock.
+class Histograma:
+    def __init__(self, limites=LIMITES):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        indice = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            self.cuentas[indice] += 1
+            self.suma += valor
+            self.total += 1
+
+    def copia(self):
+        with self._lock:
+            return list(self.cuentas), self.suma, self.total
+
+    # Percentil aproximado: límite superior del intervalo donde cae
+    def percentil(self, p):
+        cuentas, _, total = self.copia()
+        if not total:
+            return 0.0
+        objetivo = p * total
+        acumulado = 0
+        for indice, cuenta in enumerate(cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return self.limites[indice] if indice < len(self.limites) else float("inf")
+        return float("inf")
+
+# Registro de métricas del proceso: un histograma de duración por etapa y contadores.
+# Otras fuentes (cachés, cola, uso de tokens) se agregan como funciones que devuelven
+# {nombre: valor} y se consultan solo al exportar.
+class Metricas:
+    def __init__(self):
+        self._etapas = {}
+        self._contadores = {}
+        self._fuentes = {}
+        self._lock = threading.Lock()
+
+    def _histograma(self, etapa):
+        histograma = self._etapas.get(etapa)
+        if histograma is None:
+            with self._lock:
+                histograma = self._etapas.setdefault(etapa, Histograma())
+        return histograma
+
+    def observar(self, etapa, segundos):
+        self._histograma(etapa).observar(segundos)
+
+    # Mide la duración de un bloque; sirve también alrededor de un await
+    @contextmanager
+    def medir(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio)
+
+    def contar(self, nombre, cantidad=1):
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + cantidad
+
+    def agregar_fuente(self, nombre, funcion):
+        self._fuentes[nombre] = funcion
+
+    def _valores_fuentes(self):
+        valores = {}
+        for nombre, funcion in list(self._fuentes.items()):
+            try:
+                datos = funcion()
+            except Exception:
+                continue
+            for clave, valor in (datos or {}).items():
+                if isinstance(valor, (int, float)):
+                    valores[f"{nombre}_{clave}"] = valor
+        return valores
+
+    # Formato de texto de Prometheus. Las fuentes pueden consultar MongoDB: no llamar desde
+    # el bucle de eventos sin asyncio.to_thread.
+    def texto_prometheus(self):
+        lineas = [
+            "# HELP bee_etapa_segundos Duración de cada etapa.",
+            "# TYPE bee_etapa_segundos histogram"
+        ]
+        for etapa, histograma in sorted(self._etapas.items()):
+            cuentas, suma, total = histograma.copia()
+            acumulado = 0
+            for limite, cuenta in zip(histograma.limites, cuentas):
+                acumulado += cuenta
+                lineas.append(f'bee_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+            lineas.append(f'bee_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {total}')
+            lineas.append(f'bee_etapa_segundos_sum{{etapa="{etapa}"}} {suma}')
+            lineas.append(f'bee_etapa_segundos_count{{etapa="{etapa}"}} {total}')
+        with self._lock:
+            contadores = dict(self._contadores)
+        for nombre, valor in sorted(contadores.items()):
+            lineas.append(f"# TYPE bee_{nombre}_total counter")
+            lineas.append(f"bee_{nombre}_total {valor}")
+        for nombre, valor in sorted(self._valores_fuentes().items()):
+            lineas.append(f"# TYPE bee_{nombre} gauge")
+            lineas.append(f"bee_{nombre} {valor}")
+        return "\n".join(lineas) + "\n"
+
+    # Resumen legible para el comando /stats
+    def resumen(self):
+        lineas = ["Etapa: n, p50, p95, p99"]
+        for etapa, histograma in sorted(self._etapas.items()):
+            lineas.append(
+                f"{etapa}: {histograma.total}, "
+                f"{histograma.percentil(0.5):g}s, {histograma.percentil(0.95):g}s, {histograma.percentil(0.99):g}s"
+            )
+        with self._lock:
+            contadores = dict(self._contadores)
+        for nombre, valor in sorted({**contadores, **self._valores_fuentes()}.items()):
+            lineas.append(f"{nombre}: {round(valor, 3) if isinstance(valor, float) else valor}")
+        return "\n".join(lineas)
+
+metricas = Metricas()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from metricas import metricas
+
+# Carpeta de los PDF generados; el nombre de cada archivo es el hash de su contenido
+DIRECTORIO = os.getenv("PDF_DIRECTORIO", os.path.join(os.path.expanduser("~"), ".bee_app", "pdfs"))
+# Tamaño máximo de la carpeta; al pasarlo se borran los PDF usados hace más tiempo
+CAPACIDAD = int(float(os.getenv("PDF_CACHE_MB", "200")) * 1024 * 1024)
+PROCESOS = int(os.getenv("PDF_PROCESOS", "2"))
+
+# Dibuja el PDF con FPDF. Se ejecuta en un proceso aparte; escribe en un archivo temporal y lo
+# renombra al terminar para que nunca se lea un PDF a medias.
+def dibujar_pdf(titulo, texto, archivo):
+    from fpdf import FPDF  # Librería para generar PDFs
+    # Las fuentes base de FPDF solo tienen latin-1; los demás caracteres se sustituyen
+    titulo = titulo.encode("latin-1", "replace").decode("latin-1")
+    texto = texto.encode("latin-1", "replace").decode("latin-1")
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', size=16)
+    pdf.cell(0, 10, txt=titulo, ln=True, align='C')
+    pdf.ln(10)  # Espaciado
+
+    pdf.set_font("Arial", size=12)
+    for parrafo in texto.split('\n\n'):
+        pdf.multi_cell(0, 10, txt=parrafo)
+        pdf.ln(5)  # Espacio entre párrafos
+
+    temporal = f"{archivo}.{os.getpid()}.tmp"
+    pdf.output(temporal)
+    os.replace(temporal, archivo)
+    return archivo
+
+# Renderizador de PDF con caché en disco.
+# El mismo título y texto producen siempre el mismo archivo, así que un PDF repetido no se vuelve a
+# dibujar y dos generaciones simultáneas nunca se pisan. El dibujo corre en un grupo de procesos
+# para no ocupar el intérprete de la app ni el bucle del bot.
+class RenderizadorPDF:
+    def __init__(self, directorio=DIRECTORIO, capacidad=CAPACIDAD, procesos=PROCESOS):
+        self.directorio = directorio
+        self.capacidad = capacidad
+        self.procesos = procesos
+        self._grupo = None
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    # Los procesos se crean con fork: con spawn o forkserver cada proceso volvería a ejecutar el
+    # script principal (main.py abriría otra ventana de Kivy). El proceso hijo solo ejecuta
+    # dibujar_pdf, que no toca la ventana ni los hilos del padre. fork solo se usa en Linux: en
+    # macOS hacer fork de un proceso con SDL y otros hilos vivos no es seguro (por eso Python usa
+    # spawn allí), así que en macOS y Windows se usan hilos.
+    def _obtener_grupo(self):
+        if self._grupo is None:
+            if sys.platform.startswith("linux"):
+                import fpdf  # noqa: F401  Se importa antes de crear los procesos para que la hereden
+                contexto = multiprocessing.get_context("fork")
+                self._grupo = ProcessPoolExecutor(max_workers=self.procesos, mp_context=contexto)
+            else:
+                self._grupo = ThreadPoolExecutor(max_workers=self.procesos)
+        return self._grupo
+
+    def ruta(self, titulo, texto):
+        resumen = hashlib.sha256(f"{titulo}\0{texto}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directorio, f"{resumen}.pdf")
+
+    # Devuelve un Future con la ruta del PDF; si ya existe o se está dibujando, no se repite el trabajo
+    def enviar(self, titulo, texto):
+        ruta = self.ruta(titulo, texto)
+        with self._lock:
+            futuro = self._en_curso.get(ruta)
+            if futuro is not None:
+                return futuro
+            if os.path.exists(ruta):
+                # La fecha de modificación marca el último uso para el descarte
+                os.utime(ruta)
+                metricas.contar("pdf_reutilizados")
+                futuro = Future()
+                futuro.set_result(ruta)
+                return futuro
+            os.makedirs(self.directorio, exist_ok=True)
+            futuro = self._obtener_grupo().submit(dibujar_pdf, titulo, texto, ruta)
+            self._en_curso[ruta] = futuro
+        futuro.add_done_callback(lambda f: self._terminado(ruta, f))
+        return futuro
+
+    def _terminado(self, ruta, futuro):
+        with self._lock:
+            self._en_curso.pop(ruta, None)
+        if futuro.exception() is None:
+            metricas.contar("pdf_dibujados")
+            self.recortar()
+
+    # Bloqueante, para hilos en segundo plano
+    def renderizar(self, titulo, texto):
+        with metricas.medir("pdf"):
+            return self.enviar(titulo, texto).result()
+
+    async def renderizar_async(self, titulo, texto):
+        with metricas.medir("pdf"):
+            return await asyncio.wrap_future(self.enviar(titulo, texto))
+
+    # Borra los PDF usados hace más tiempo hasta que la carpeta quepa en la capacidad
+    def recortar(self):
+        try:
+            archivos = []
+            for entrada in os.scandir(self.directorio):
+                if entrada.name.endswith(".pdf") and entrada.is_file():
+                    estado = entrada.stat()
+                    archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+        except OSError as e:
+            logging.warning(f"No se pudo revisar la carpeta de PDF: {e}")
+            return
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.capacidad:
+                break
+            with self._lock:
+                if ruta in self._en_curso:
+                    continue
+            try:
+                os.remove(ruta)
+                total -= tamano
+            except OSError:
+                pass
+
+    def cerrar(self):
+        if self._grupo is not None:
+            self._grupo.shutdown(wait=False, cancel_futures=True)
+            self._grupo = None
+
+renderizador = RenderizadorPDF()
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import time
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Segundos entre escrituras por lotes de los datos modificados
+INTERVALO_ESCRITURA = float(os.getenv("BOT_PERSISTENCIA_INTERVALO", "1"))
+# Segundos que una lectura de MongoDB se reutiliza sin volver a consultar (0 = consultar siempre).
+# Un valor corto ahorra una consulta por mensaje en ráfagas del mismo chat (botones, varias
+# preguntas seguidas). Con varias instancias sin afinidad de sesión (el balanceador reparte los
+# mensajes de un chat entre instancias), una instancia puede usar durante ese tiempo datos que otra
+# ya cambió; en ese despliegue conviene 0, y con afinidad o una sola instancia se puede subir.
+VIGENCIA_LECTURA = float(os.getenv("BOT_PERSISTENCIA_VIGENCIA", "2"))
+
+# Persistencia de user_data y chat_data en la colección db.estado_bot.
+# Permite correr varias instancias del bot detrás de un balanceador: antes de cada actualización
+# se recargan los datos del usuario y del chat desde MongoDB (salvo que se hayan leído hace menos
+# de VIGENCIA_LECTURA segundos), y los cambios se escriben en lote (un solo bulk_write) cada
+# INTERVALO_ESCRITURA segundos.
+class PersistenciaMongo(BasePersistence):
+    def __init__(self, coleccion=None, intervalo=INTERVALO_ESCRITURA, vigencia=VIGENCIA_LECTURA):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=intervalo
+        )
+        self._coleccion = coleccion
+        self.vigencia = vigencia
+        # Última versión leída o escrita de cada documento, para detectar cambios locales sin guardar
+        self._sincronizado = {}
+        self._leido = {}
+        self._pendientes = {}
+        self._escritura = None
+
+    @property
+    def coleccion(self):
+        if self._coleccion is None:
+            from base_datos import db
+            self._coleccion = db.estado_bot
+        return self._coleccion
+
+    @staticmethod
+    def _id(tipo, identificador):
+        return f"{tipo}:{identificador}"
+
+    # Lee un documento; devuelve None si no existe
+    async def _leer(self, clave):
+        leido = self._leido.get(clave)
+        if leido is not None and time.monotonic() - leido < self.vigencia:
+            return self._sincronizado.get(clave)
+        documento = await asyncio.to_thread(self.coleccion.find_one, {"_id": clave}, {"datos": 1})
+        self._leido[clave] = time.monotonic()
+        return documento.get("datos", {}) if documento else None
+
+    # Sustituye los datos en memoria por los de MongoDB, salvo que haya cambios locales
+    # pendientes de guardar (en ese caso la copia local es la más reciente)
+    async def _refrescar(self, clave, datos):
+        if clave in self._pendientes:
+            return
+        if clave in self._sincronizado and datos != self._sincronizado[clave]:
+            return
+        remotos = await self._leer(clave)
+        if remotos is None:
+            return
+        datos.clear()
+        datos.update(remotos)
+        self._sincronizado[clave] = deepcopy(remotos)
+
+    def _encolar(self, clave, datos):
+        self._pendientes[clave] = datos
+        if datos is None:
+            self._sincronizado.pop(clave, None)
+        else:
+            self._sincronizado[clave] = deepcopy(datos)
+        if self._escritura is None or self._escritura.done():
+            self._escritura = asyncio.get_running_loop().create_task(self._escribir())
+
+    async def _escribir(self):
+        from pymongo import DeleteOne, ReplaceOne
+        # Se cede el turno para que el resto de update_*_data de esta ronda entren en el mismo lote
+        await asyncio.sleep(0)
+        pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return
+        ahora = datetime.now(timezone.utc)
+        operaciones = [
+            DeleteOne({"_id": clave}) if datos is None
+            else ReplaceOne({"_id": clave}, {"datos": datos, "actualizado": ahora}, upsert=True)
+            for clave, datos in pendientes.items()
+        ]
+        try:
+            await asyncio.to_thread(self.coleccion.bulk_write, operaciones, ordered=False)
+        except Exception as e:
+            logging.error(f"Error al guardar el estado del bot: {e}")
+            # Se reintenta en la siguiente ronda sin pisar cambios más recientes
+            for clave, datos in pendientes.items():
+                self._pendientes.setdefault(clave, datos)
+
+    # Los datos se cargan bajo demanda en refresh_*; al iniciar no se lee toda la colección
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self._encolar(self._id("usuario", user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._encolar(self._id("chat", chat_id), data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._encolar(self._id("usuario", user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._encolar(self._id("chat", chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refrescar(self._id("usuario", user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refrescar(self._id("chat", chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Al detener el bot se escribe lo que quede pendiente
+    async def flush(self):
+        if self._escritura is not None and not self._escritura.done():
+            await self._escritura
+        await self._escribir()
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from cache_resultados import normalizar_tema
+from generacion import MODELO, completar, completar_sincrono, completar_sincrono_en_flujo
+
+# Carga las variables de entorno
+load_dotenv()
+
+# Versión de las instrucciones; al cambiarla se regeneran todos los fragmentos
+VERSION_PROMPT = "1"
+# Tokens máximos de cada fragmento por tema
+MAX_TOKENS_FRAGMENTO = {"resumen": 350, "guia": 350}
+# Generación por partes: a partir de cuántos temas se usa, temas por parte y partes simultáneas.
+# Con un tema por parte cada parte se guarda como fragmento y se reutiliza en selecciones futuras.
+MIN_TEMAS_POR_PARTES = int(os.getenv("GENERACION_MIN_TEMAS_POR_PARTES", "3"))
+TEMAS_POR_PARTE = int(os.getenv("GENERACION_TEMAS_POR_PARTE", "1"))
+HILOS_POR_PARTES = int(os.getenv("GENERACION_HILOS_POR_PARTES", "4"))
+
+SISTEMAS = {
+    "resumen": "Eres un asistente que genera resúmenes educativos.",
+    "guia": "Eres un asistente que genera guías de estudio educativas."
+}
+
+PROMPTS = {
+    "resumen": "Genera un resumen detallado del tema \"{titulo}\" de la materia {materia}, sin comentarios adicionales.",
+    "guia": "Genera una guía de estudio con preguntas clave del tema \"{titulo}\" de la materia {materia}, sin comentarios adicionales."
+}
+
+# Prompts de una parte con varios temas
+PROMPTS_PARTE = {
+    "resumen": "Genera un resumen detallado de cada uno de los siguientes temas de la materia {materia}, en el mismo orden, con el título de cada tema y sin comentarios adicionales: {temas}",
+    "guia": "Genera una guía de estudio con preguntas clave de cada uno de los siguientes temas de la materia {materia}, en el mismo orden, con el título de cada tema y sin comentarios adicionales: {temas}"
+}
+
+# Título con el mismo formato que muestra TemarioScreen: "numero. titulo"
+def titulo_tema(tema):
+    return f"{tema.get('numero', '')}. {tema.get('titulo', 'Título desconocido')}"
+
+# Hash del contenido que determina un fragmento; si no cambia, el fragmento no se regenera
+def hash_fragmento(tipo, materia, titulo):
+    datos = "|".join([VERSION_PROMPT, MODELO, tipo, materia, titulo])
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+def id_fragmento(tipo, materia, titulo):
+    return f"{tipo}|{materia}|{normalizar_tema(titulo)}"
+
+# Recorre el catálogo y devuelve los fragmentos que faltan o cuyo hash ya no coincide
+def fragmentos_pendientes(db, tipos, materia=None):
+    filtro = {"nombre": materia} if materia else {}
+    existentes = {
+        documento["_id"]: documento.get("hash")
+        for documento in db.fragmentos.find({"tipo": {"$in": list(tipos)}}, {"hash": 1})
+    }
+    pendientes = []
+    for documento in db.materias.find(filtro, {"_id": 0, "nombre": 1, "temas.numero": 1, "temas.titulo": 1}):
+        nombre = documento.get("nombre")
+        for tema in documento.get("temas", []):
+            titulo = titulo_tema(tema)
+            for tipo in tipos:
+                hash_actual = hash_fragmento(tipo, nombre, titulo)
+                if existentes.get(id_fragmento(tipo, nombre, titulo)) != hash_actual:
+                    pendientes.append((tipo, nombre, titulo, hash_actual))
+    return pendientes
+
+def guardar_fragmento(db, tipo, materia, titulo, texto, hash_actual=None):
+    db.fragmentos.replace_one(
+        {"_id": id_fragmento(tipo, materia, titulo)},
+        {
+            "tipo": tipo,
+            "materia": materia,
+            "titulo": titulo,
+            "titulo_normalizado": normalizar_tema(titulo),
+            "hash": hash_actual or hash_fragmento(tipo, materia, titulo),
+            "modelo": MODELO,
+            "texto": texto,
+            "actualizado": datetime.now(timezone.utc)
+        },
+        upsert=True
+    )
+
+async def _generar_fragmento(db, semaforo, tipo, materia, titulo, hash_actual):
+    async with semaforo:
+        prompt = PROMPTS[tipo].format(titulo=titulo, materia=materia)
+        texto = await completar(SISTEMAS[tipo], prompt, max_tokens=MAX_TOKENS_FRAGMENTO[tipo])
+    await asyncio.to_thread(guardar_fragmento, db, tipo, materia, titulo, texto, hash_actual)
+
+# Genera todos los fragmentos pendientes con como máximo "hilos" llamadas simultáneas.
+# Devuelve (generados, fallidos); un fallo no detiene al resto.
+async def precalcular(db, tipos=("resumen", "guia"), hilos=4, materia=None):
+    pendientes = await asyncio.to_thread(fragmentos_pendientes, db, tipos, materia)
+    logging.info(f"Fragmentos por generar: {len(pendientes)}")
+    semaforo = asyncio.Semaphore(hilos)
+    resultados = await asyncio.gather(
+        *[_generar_fragmento(db, semaforo, *pendiente) for pendiente in pendientes],
+        return_exceptions=True
+    )
+    fallidos = 0
+    for pendiente, resultado in zip(pendientes, resultados):
+        if isinstance(resultado, BaseException):
+            fallidos += 1
+            logging.error(f"Error al generar el fragmento {pendiente[0]} de '{pendiente[2]}': {resultado}")
+    return len(pendientes) - fallidos, fallidos
+
+# Temas normalizados, sin repetir y en el orden recibido
+def _normalizar_en_orden(temas):
+    if isinstance(temas, str):
+        temas = re.split(r"[,;\n]+", temas)
+    normalizados = {}
+    for tema in temas:
+        normalizado = normalizar_tema(tema)
+        if normalizado and normalizado not in normalizados:
+            normalizados[normalizado] = tema.strip()
+    return normalizados
+
+# Fragmentos guardados de los temas de una materia: {titulo_normalizado: (titulo, texto)}.
+# Los títulos se repiten entre materias ("1. Introducción"), así que sin materia no se busca nada.
+def _fragmentos_guardados(db, tipo, materia, normalizados):
+    if not materia or not normalizados:
+        return {}
+    return {
+        documento["titulo_normalizado"]: (documento["titulo"], documento["texto"])
+        for documento in db.fragmentos.find(
+            {"tipo": tipo, "materia": materia, "titulo_normalizado": {"$in": list(normalizados)}},
+            {"titulo": 1, "titulo_normalizado": 1, "texto": 1}
+        )
+    }
+
+# Arma un resumen o guía de varios temas de una materia a partir de los fragmentos precalculados.
+# Devuelve None si falta alguno de los temas, para que se genere de la forma habitual.
+def componer_desde_fragmentos(db, tipo, temas, materia):
+    normalizados = _normalizar_en_orden(temas)
+    if not normalizados or not materia:
+        return None
+    textos = _fragmentos_guardados(db, tipo, materia, normalizados)
+    if len(textos) < len(normalizados):
+        return None
+    return "\n\n".join(f"{textos[n][0]}\n\n{textos[n][1]}" for n in normalizados)
+
+# Genera un resumen o guía de muchos temas por partes ("map-reduce"): los temas que ya tienen
+# fragmento se reutilizan, los demás se reparten en partes de temas_por_parte que se generan en
+# paralelo con como máximo "hilos" llamadas a la vez, y todo se une en el orden de la selección.
+# El tiempo total depende de la parte más lenta y no de la longitud del documento completo.
+# Es bloqueante: se llama desde un hilo en segundo plano. Si una parte falla se lanza su error.
+# Con al_avanzar cada parte se genera en flujo y el texto se entrega en orden: la parte en curso
+# conforme llega del modelo y las siguientes en cuanto terminan las anteriores; la unión de lo
+# entregado es el texto devuelto. Si se activa "cancelacion" (threading.Event), las partes que no
+# han empezado se omiten y las que están en flujo se cortan en el siguiente fragmento.
+def generar_por_partes(db, tipo, temas, materia, temas_por_parte=TEMAS_POR_PARTE, hilos=HILOS_POR_PARTES,
+                       al_avanzar=None, cancelacion=None):
+    normalizados = _normalizar_en_orden(temas)
+    guardados = _fragmentos_guardados(db, tipo, materia, normalizados)
+    faltantes = [n for n in normalizados if n not in guardados]
+    tamano = max(1, temas_por_parte)
+    partes = [faltantes[i:i + tamano] for i in range(0, len(faltantes), tamano)]
+
+    # Un bloque por tema guardado y por parte, en el orden de la selección: [textos, terminado].
+    # Cada parte se coloca en la posición de su primer tema.
+    bloques = []
+    bloque_de_parte = {}
+    primeros = {parte[0] for parte in partes}
+    for normalizado in normalizados:
+        if normalizado in guardados:
+            titulo, texto = guardados[normalizado]
+            bloques.append([[f"{titulo}\n\n{texto}"], True])
+        elif normalizado in primeros:
+            bloque_de_parte[normalizado] = [[], False]
+            bloques.append(bloque_de_parte[normalizado])
+    lock = threading.Lock()
+    # Bloque que se está entregando, textos ya entregados de él y si ya se entregó algo antes
+    actual = entregados = 0
+    con_texto = False
+
+    def avanzar():
+        nonlocal actual, entregados, con_texto
+        while actual < len(bloques):
+            textos, terminado = bloques[actual]
+            while entregados < len(textos):
+                texto = textos[entregados]
+                if entregados == 0 and con_texto:
+                    texto = "\n\n" + texto
+                al_avanzar(texto)
+                con_texto = True
+                entregados += 1
+            if not terminado:
+                return
+            actual += 1
+            entregados = 0
+
+    def agregar(bloque, texto):
+        with lock:
+            bloque[0].append(texto)
+            if al_avanzar is not None:
+                avanzar()
+
+    def generar_parte(parte):
+        if cancelacion is not None and cancelacion.is_set():
+            return
+        bloque = bloque_de_parte[parte[0]]
+        titulos = [normalizados[n] for n in parte]
+        if len(parte) == 1:
+            prompt = PROMPTS[tipo].format(titulo=titulos[0], materia=materia)
+        else:
+            prompt = PROMPTS_PARTE[tipo].format(temas="; ".join(titulos), materia=materia)
+        max_tokens = MAX_TOKENS_FRAGMENTO[tipo] * len(parte)
+        # Una parte de un solo tema lleva el título delante, como los fragmentos guardados
+        encabezado = f"{titulos[0]}\n\n" if len(parte) == 1 else ""
+        try:
+            if al_avanzar is None:
+                texto = completar_sincrono(SISTEMAS[tipo], prompt, max_tokens)
+                agregar(bloque, encabezado + texto)
+            else:
+                recibidos = []
+                for fragmento in completar_sincrono_en_flujo(SISTEMAS[tipo], prompt, max_tokens, cancelacion):
+                    agregar(bloque, encabezado + fragmento if not recibidos else fragmento)
+                    recibidos.append(fragmento)
+                texto = "".join(recibidos).strip()
+        finally:
+            with lock:
+                bloque[1] = True
+                if al_avanzar is not None:
+                    avanzar()
+        if len(parte) == 1 and materia and texto and not (cancelacion is not None and cancelacion.is_set()):
+            guardar_fragmento(db, tipo, materia, titulos[0], texto)
+
+    if al_avanzar is not None:
+        with lock:
+            avanzar()
+    if partes:
+        with ThreadPoolExecutor(max_workers=min(hilos, len(partes))) as pool:
+            # list() hace que el error de una parte se lance aquí
+            list(pool.map(generar_parte, partes))
+    return "\n\n".join("".join(textos) for textos, _ in bloques if textos)
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Precalcula resúmenes y guías por tema de todo el catálogo de materias.")
+    parser.add_argument("--hilos", type=int, default=4, help="llamadas simultáneas a OpenAI")
+    parser.add_argument("--tipo", choices=["resumen", "guia"], action="append", help="tipo de fragmento (por defecto, ambos)")
+    parser.add_argument("--materia", help="limitar a una sola materia")
+    args = parser.parse_args()
+
+    from base_datos import asegurar_indices, db
+    asegurar_indices(db)
+    generados, fallidos = asyncio.run(
+        precalcular(db, tipos=tuple(args.tipo or ("resumen", "guia")), hilos=args.hilos, materia=args.materia)
+    )
+    logging.info(f"Fragmentos generados: {generados}, con error: {fallidos}")
+    exit(1 if fallidos else 0)
@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+from metricas import metricas
+
+# Ventana de contexto del modelo (prompt + respuesta)
+CONTEXTO = int(os.getenv("OPENAI_CONTEXTO", "4096"))
+# Tope de tokens de una respuesta; los temas que no caben se reparten en varias solicitudes
+MAX_RESPUESTA = int(os.getenv("OPENAI_MAX_TOKENS_RESPUESTA", "1500"))
+# Tokens máximos del texto del usuario (una pregunta o los temas de una solicitud); en una pregunta
+# lo que sobra se recorta y los temas que no caben se reparten en varias solicitudes
+MAX_ENTRADA = int(os.getenv("OPENAI_MAX_TOKENS_ENTRADA", "1500"))
+
+# Tokens de respuesta: una base por solicitud más una cantidad por tema
+TOKENS_BASE = {"resumen": 150, "guia": 150}
+TOKENS_POR_TEMA = {"resumen": 250, "guia": 300}
+# Las preguntas reciben entre MIN y MAX tokens según la longitud de la pregunta
+MIN_TOKENS_PREGUNTA = 200
+MAX_TOKENS_PREGUNTA = 800
+# Tokens que ocupan los roles y separadores de los mensajes del chat
+_MARGEN = 50
+# Sin tiktoken: caracteres por token en las palabras largas (URLs, códigos, texto sin espacios)
+_CARACTERES_POR_TOKEN = 4
+
+_codificador = None
+_sin_tiktoken = False
+
+# tiktoken es opcional: si no está instalado se usa una estimación
+def _obtener_codificador():
+    global _codificador, _sin_tiktoken
+    if _codificador is None and not _sin_tiktoken:
+        try:
+            import tiktoken
+        except ImportError:
+            _sin_tiktoken = True
+            return None
+        from generacion import MODELO
+        try:
+            _codificador = tiktoken.encoding_for_model(MODELO)
+        except KeyError:
+            _codificador = tiktoken.get_encoding("cl100k_base")
+    return _codificador
+
+# Estimación sin tiktoken para una palabra o un signo: ~1.3 tokens por palabra en español,
+# las palabras largas según su longitud, y uno por signo
+def _estimar(pieza):
+    if not (pieza[0].isalnum() or pieza[0] == "_"):
+        return 1
+    return max(1.3, len(pieza) / _CARACTERES_POR_TOKEN)
+
+def contar_tokens(texto):
+    codificador = _obtener_codificador()
+    if codificador is not None:
+        return len(codificador.encode(texto))
+    return math.ceil(sum(_estimar(pieza) for pieza in re.findall(r"\w+|[^\w\s]", texto)))
+
+# Recorta un texto a max_tokens sin partir palabras. Una palabra que por sí sola pasa de
+# max_tokens (por ejemplo un texto sin espacios) se corta por caracteres.
+def recortar(texto, max_tokens):
+    if contar_tokens(texto) <= max_tokens:
+        return texto
+    codificador = _obtener_codificador()
+    if codificador is not None:
+        recortado = codificador.decode(codificador.encode(texto)[:max_tokens])
+        if " " in recortado:
+            recortado = recortado.rsplit(" ", 1)[0]
+        return recortado
+    usados, fin = 0, 0
+    for pieza in re.finditer(r"\w+|[^\w\s]", texto):
+        tokens = _estimar(pieza.group())
+        if usados + tokens > max_tokens:
+            if tokens > max_tokens:
+                fin = pieza.start() + int((max_tokens - usados) * _CARACTERES_POR_TOKEN)
+            break
+        usados += tokens
+        fin = pieza.end()
+    return texto[:fin].rstrip()
+
+# Quita la última oración si la respuesta se cortó por llegar a max_tokens
+def cerrar_en_oracion(texto):
+    fin = max(texto.rfind(signo) for signo in (".", "!", "?", "\n"))
+    return texto[:fin + 1].rstrip() if fin > len(texto) // 2 else texto
+
+# Tokens de respuesta para una solicitud según su tipo, los temas que incluye y el tamaño del prompt
+def max_tokens_para(tipo, temas=1, tokens_prompt=0):
+    if tipo in TOKENS_POR_TEMA:
+        deseados = TOKENS_BASE[tipo] + TOKENS_POR_TEMA[tipo] * max(1, temas)
+    else:
+        deseados = min(MAX_TOKENS_PREGUNTA, max(MIN_TOKENS_PREGUNTA, 2 * tokens_prompt))
+    disponibles = CONTEXTO - tokens_prompt - _MARGEN
+    return max(1, min(deseados, MAX_RESPUESTA, disponibles))
+
+# Temas que caben en una sola respuesta sin que se corte
+def temas_por_solicitud(tipo):
+    return max(1, (MAX_RESPUESTA - TOKENS_BASE[tipo]) // TOKENS_POR_TEMA[tipo])
+
+# Lista de temas a partir del texto enviado al bot
+def separar_temas(texto):
+    if not isinstance(texto, str):
+        return list(texto)
+    return [tema.strip() for tema in re.split(r"[,;\n]+", texto) if tema.strip()]
+
+# Reparte los temas (texto o lista) en grupos que caben en una solicitud: como mucho
+# temas_por_solicitud temas y MAX_ENTRADA tokens de temas por grupo. Un tema que por sí solo
+# pasa de MAX_ENTRADA se recorta.
+def dividir_temas(tipo, temas):
+    tamano = temas_por_solicitud(tipo)
+    grupos, grupo, tokens = [], [], 0
+    for tema in separar_temas(temas):
+        tema = recortar(tema, MAX_ENTRADA)
+        # Un token más por el separador ", "
+        tokens_tema = contar_tokens(tema) + 1
+        if grupo and (len(grupo) >= tamano or tokens + tokens_tema > MAX_ENTRADA):
+            grupos.append(grupo)
+            grupo, tokens = [], 0
+        grupo.append(tema)
+        tokens += tokens_tema
+    if grupo:
+        grupos.append(grupo)
+    return grupos or [[]]
+
+# Tokens consumidos por las solicitudes del proceso, en total y por chat en el día (UTC) en curso;
+# el uso por chat sirve para la cuota diaria del bot (ver limites.py)
+class RegistroUso:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.solicitudes = 0
+        self.tokens_prompt = 0
+        self.tokens_respuesta = 0
+        self._dia = None
+        self._por_chat = {}
+
+    def _renovar_dia(self):
+        dia = datetime.now(timezone.utc).date()
+        if dia != self._dia:
+            self._dia = dia
+            self._por_chat = {}
+
+    def registrar(self, tokens_prompt, tokens_respuesta, chat_id=None):
+        with self._lock:
+            self.solicitudes += 1
+            self.tokens_prompt += tokens_prompt
+            self.tokens_respuesta += tokens_respuesta
+            if chat_id is not None:
+                self._renovar_dia()
+                self._por_chat[chat_id] = self._por_chat.get(chat_id, 0) + tokens_prompt + tokens_respuesta
+        logging.debug(f"Tokens usados (chat {chat_id}): prompt {tokens_prompt}, respuesta {tokens_respuesta}")
+
+    # Tokens que este proceso ha usado hoy para un chat
+    def uso_del_dia(self, chat_id):
+        with self._lock:
+            self._renovar_dia()
+            return self._por_chat.get(chat_id, 0)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "solicitudes": self.solicitudes,
+                "tokens_prompt": self.tokens_prompt,
+                "tokens_respuesta": self.tokens_respuesta
+            }
+
+registro_uso = RegistroUso()
+metricas.agregar_fuente("uso", registro_uso.estadisticas)
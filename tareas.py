@@ -0,0 +1,63 @@
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from kivy.clock import Clock
+
+# Hilos disponibles para el trabajo bloqueante de la app (OpenAI, PDF, MongoDB)
+MAX_HILOS = int(os.getenv("APP_MAX_HILOS", "4"))
+
+# Tarea en segundo plano: envuelve el Future y una señal de cancelación cooperativa.
+# Si se cancela, sus callbacks ya no se ejecutan aunque el trabajo llegue a terminar.
+class Tarea:
+    def __init__(self):
+        self.future = None
+        self.cancelada = threading.Event()
+
+    def cancelar(self):
+        self.cancelada.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def terminada(self):
+        return self.future is not None and self.future.done()
+
+# Ejecutor de tareas: corre funciones bloqueantes en un pool de hilos y
+# entrega el resultado (o el error) en el hilo principal de Kivy con Clock.schedule_once.
+class EjecutorTareas:
+    def __init__(self, max_hilos=MAX_HILOS):
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="tarea")
+
+    # Ejecuta funcion(*args, **kwargs) en segundo plano.
+    # al_terminar(resultado) y al_fallar(error) se llaman en el hilo principal.
+    # Con pasar_cancelacion=True la función recibe el threading.Event de cancelación
+    # en el argumento "cancelacion" para poder detenerse a medio camino.
+    def ejecutar(self, funcion, *args, al_terminar=None, al_fallar=None, pasar_cancelacion=False, **kwargs):
+        tarea = Tarea()
+        if pasar_cancelacion:
+            kwargs["cancelacion"] = tarea.cancelada
+        tarea.future = self._pool.submit(funcion, *args, **kwargs)
+        tarea.future.add_done_callback(lambda future: self._entregar(tarea, al_terminar, al_fallar))
+        return tarea
+
+    def _entregar(self, tarea, al_terminar, al_fallar):
+        if tarea.cancelada.is_set():
+            return
+        try:
+            resultado = tarea.future.result()
+        except CancelledError:
+            return
+        except Exception as e:
+            if al_fallar is not None:
+                Clock.schedule_once(lambda dt, error=e: al_fallar(error))
+            else:
+                print(f"Error en tarea en segundo plano: {e}")
+            return
+        if al_terminar is not None:
+            Clock.schedule_once(lambda dt: None if tarea.cancelada.is_set() else al_terminar(resultado))
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+ejecutor = EjecutorTareas()
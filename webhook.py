@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+from generacion import limitador
+from metricas import metricas
+
+# Configuración del servidor de webhook
+ESCUCHA = os.getenv("BOT_WEBHOOK_ESCUCHA", "0.0.0.0")
+PUERTO = int(os.getenv("BOT_WEBHOOK_PUERTO", "8443"))
+RUTA = os.getenv("BOT_WEBHOOK_RUTA", "telegram")
+# URL pública que se registra en Telegram (por ejemplo https://bot.ejemplo.mx/telegram)
+URL_PUBLICA = os.getenv("BOT_WEBHOOK_URL")
+# Telegram envía este secreto en cada petición; las que no lo traen se rechazan
+SECRETO = os.getenv("BOT_WEBHOOK_SECRETO")
+
+# Recibe una actualización en JSON y la deja en la cola de la aplicación.
+# Responde de inmediato: el procesamiento ocurre después, en paralelo con las demás.
+async def recibir_actualizacion(request):
+    application = request.app["application"]
+    if SECRETO and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != SECRETO:
+        return web.Response(status=403)
+    try:
+        datos = await request.json()
+    except ValueError:
+        return web.Response(status=400, text="JSON no válido")
+    await application.update_queue.put(Update.de_json(datos, application.bot))
+    return web.Response(text="ok")
+
+async def salud(request):
+    return web.Response(text="ok")
+
+# Métricas en formato de texto de Prometheus; se arman en un hilo porque consultan la cola en MongoDB
+async def exportar_metricas(request):
+    texto = await asyncio.to_thread(metricas.texto_prometheus)
+    return web.Response(text=texto, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+def crear_servidor(application):
+    servidor = web.Application()
+    servidor["application"] = application
+    servidor.router.add_post(f"/{RUTA}", recibir_actualizacion)
+    servidor.router.add_get("/salud", salud)
+    servidor.router.add_get("/metrics", exportar_metricas)
+    return servidor
+
+# Servidor que solo expone /metrics y /salud, para el modo polling. Devuelve su AppRunner.
+async def iniciar_servidor_metricas(puerto):
+    servidor = web.Application()
+    servidor.router.add_get("/salud", salud)
+    servidor.router.add_get("/metrics", exportar_metricas)
+    runner = web.AppRunner(servidor)
+    await runner.setup()
+    await web.TCPSite(runner, ESCUCHA, puerto).start()
+    logging.info(f"Métricas en {ESCUCHA}:{puerto}/metrics")
+    return runner
+
+# Espera SIGINT o SIGTERM; en plataformas sin add_signal_handler se detiene con Ctrl+C
+async def _esperar_senal():
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(senal, detener.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await detener.wait()
+
+# Ejecuta el bot con un servidor de webhook propio.
+# Con registrar=False no se llama a setWebhook, útil para pruebas locales enviando
+# actualizaciones sintéticas con curl a http://localhost:PUERTO/RUTA.
+# Al detenerse deja de aceptar peticiones y espera a que terminen las generaciones en curso.
+async def ejecutar_webhook(application, registrar=True):
+    async with application:
+        if registrar:
+            if not URL_PUBLICA:
+                raise RuntimeError("BOT_WEBHOOK_URL no está configurada.")
+            await application.bot.set_webhook(
+                url=URL_PUBLICA,
+                secret_token=SECRETO,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=100
+            )
+        await application.start()
+        if application.post_init:
+            await application.post_init(application)
+
+        runner = web.AppRunner(crear_servidor(application))
+        await runner.setup()
+        await web.TCPSite(runner, ESCUCHA, PUERTO).start()
+        logging.info(f"Webhook escuchando en {ESCUCHA}:{PUERTO}/{RUTA}")
+
+        try:
+            await _esperar_senal()
+        finally:
+            logging.info(f"Deteniendo el webhook; generaciones en curso: {limitador.en_curso + limitador.en_espera}")
+            await runner.cleanup()
+            # Application.stop procesa lo que quedó en la cola y espera las tareas de los manejadores
+            await application.stop()
+            # Como post_init, post_stop solo lo llama run_polling; aquí se llama a mano
+            if application.post_stop:
+                await application.post_stop(application)
+            logging.info("Webhook detenido.")